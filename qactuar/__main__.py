@@ -11,6 +11,14 @@ class MyFormatter(
     pass
 
 
+def boolean(value: str) -> bool:
+    if value.lower() in ("1", "true", "yes", "on"):
+        return True
+    if value.lower() in ("0", "false", "no", "off"):
+        return False
+    raise argparse.ArgumentTypeError(f"expected a boolean, got {value}")
+
+
 def main() -> None:
     default_config = qactuar.Config()
     parser = argparse.ArgumentParser(
@@ -38,6 +46,17 @@ def main() -> None:
         default=default_config.PORT,
         help="Port to bind to",
     )
+    parser.add_argument(
+        "-b",
+        "--bind",
+        type=str,
+        action="append",
+        dest="BIND",
+        default=default_config.BIND,
+        help="Address to listen on instead of host and port, can be given more than "
+        "once; host:port, [ipv6]:port, unix:/path/to.sock or fd://3 for an inherited "
+        "listening socket",
+    )
     parser.add_argument(
         "-s",
         "--server-type",
@@ -61,7 +80,7 @@ def main() -> None:
         type=float,
         dest="RECV_TIMEOUT",
         default=default_config.RECV_TIMEOUT,
-        help="How long to wait in seconds for data from an open client connection",
+        help="Deprecated and ignored, see --request-timeout and --body-timeout",
     )
     parser.add_argument(
         "--recv-bytes",
@@ -70,6 +89,13 @@ def main() -> None:
         default=default_config.RECV_BYTES,
         help="How many bytes to wait for from an open client connection",
     )
+    parser.add_argument(
+        "--recv-buffer-pool-size",
+        type=int,
+        dest="RECV_BUFFER_POOL_SIZE",
+        default=default_config.RECV_BUFFER_POOL_SIZE,
+        help="How many RECV_BYTES sized read buffers each process keeps for reuse",
+    )
     parser.add_argument(
         "--process-pool-size",
         type=int,
@@ -78,12 +104,221 @@ def main() -> None:
         help="PRE-FORK MODE ONLY - How many processes to start up. Recomended size is "
         "equal to the number of cpu cores; defaults to os.cpu_count()",
     )
+    parser.add_argument(
+        "--prefork-dispatch",
+        type=str,
+        dest="PREFORK_DISPATCH",
+        default=default_config.PREFORK_DISPATCH,
+        help="PRE-FORK MODE ONLY - How connections are handed to the processes; "
+        "round_robin, reuseport (each process accepts on its own SO_REUSEPORT "
+        "socket) or least_loaded (the main process accepts and passes each socket "
+        "to the process with the fewest open connections)",
+    )
     parser.add_argument(
         "--request-timeout",
         type=float,
         dest="REQUEST_TIMEOUT",
         default=default_config.REQUEST_TIMEOUT,
-        help="How long to wait in seconds for a request to be considrered timed-out",
+        help="How long to wait in seconds for a client to send the request line and "
+        "headers",
+    )
+    parser.add_argument(
+        "--body-timeout",
+        type=float,
+        dest="BODY_TIMEOUT",
+        default=default_config.BODY_TIMEOUT,
+        help="How long to wait in seconds for each part of a request body",
+    )
+    parser.add_argument(
+        "--body-total-timeout",
+        type=float,
+        dest="BODY_TOTAL_TIMEOUT",
+        default=default_config.BODY_TOTAL_TIMEOUT,
+        help="How long in seconds a client has to send the whole request body; 0 "
+        "means no limit",
+    )
+    parser.add_argument(
+        "--app-timeout",
+        type=float,
+        dest="APP_TIMEOUT",
+        default=default_config.APP_TIMEOUT,
+        help="How long in seconds an app can take to handle a request before it is "
+        "cancelled; 0 means no limit",
+    )
+    parser.add_argument(
+        "--write-timeout",
+        type=float,
+        dest="WRITE_TIMEOUT",
+        default=default_config.WRITE_TIMEOUT,
+        help="How long to wait in seconds for a client to read more of the response "
+        "before closing the connection",
+    )
+    parser.add_argument(
+        "--websocket-idle-timeout",
+        type=float,
+        dest="WEBSOCKET_IDLE_TIMEOUT",
+        default=default_config.WEBSOCKET_IDLE_TIMEOUT,
+        help="How long to wait in seconds for anything from a websocket client before "
+        "closing the connection",
+    )
+    parser.add_argument(
+        "--websocket-close-timeout",
+        type=float,
+        dest="WEBSOCKET_CLOSE_TIMEOUT",
+        default=default_config.WEBSOCKET_CLOSE_TIMEOUT,
+        help="How long to wait in seconds for a websocket client to answer a close "
+        "frame before dropping the connection",
+    )
+    parser.add_argument(
+        "--websocket-ping-interval",
+        type=float,
+        dest="WEBSOCKET_PING_INTERVAL",
+        default=default_config.WEBSOCKET_PING_INTERVAL,
+        help="How often in seconds to ping websocket clients to check they are still "
+        "there; 0 turns the heartbeat off",
+    )
+    parser.add_argument(
+        "--websocket-ping-timeout",
+        type=float,
+        dest="WEBSOCKET_PING_TIMEOUT",
+        default=default_config.WEBSOCKET_PING_TIMEOUT,
+        help="How long to wait in seconds for the pong to a heartbeat ping before "
+        "dropping the connection; 0 keeps pinging but never drops it",
+    )
+    parser.add_argument(
+        "--keep-alive-timeout",
+        type=float,
+        dest="KEEP_ALIVE_TIMEOUT",
+        default=default_config.KEEP_ALIVE_TIMEOUT,
+        help="How long to wait in seconds for the next request on a persistent "
+        "connection before closing it",
+    )
+    parser.add_argument(
+        "--keep-alive-max-requests",
+        type=int,
+        dest="KEEP_ALIVE_MAX_REQUESTS",
+        default=default_config.KEEP_ALIVE_MAX_REQUESTS,
+        help="How many requests to serve on one persistent connection before closing "
+        "it; 1 disables keep-alive",
+    )
+    parser.add_argument(
+        "--websocket-max-frame-size",
+        type=int,
+        dest="WEBSOCKET_MAX_FRAME_SIZE",
+        default=default_config.WEBSOCKET_MAX_FRAME_SIZE,
+        help="Largest websocket frame payload in bytes a client can send before the "
+        "connection is closed; 0 means no limit",
+    )
+    parser.add_argument(
+        "--websocket-max-message-size",
+        type=int,
+        dest="WEBSOCKET_MAX_MESSAGE_SIZE",
+        default=default_config.WEBSOCKET_MAX_MESSAGE_SIZE,
+        help="Largest websocket message in bytes, across all of its frames, a client "
+        "can send before the connection is closed; 0 means no limit",
+    )
+    parser.add_argument(
+        "--websocket-queue-size",
+        type=int,
+        dest="WEBSOCKET_QUEUE_SIZE",
+        default=default_config.WEBSOCKET_QUEUE_SIZE,
+        help="How many messages each websocket holds in each direction before the "
+        "sender has to wait for them to be taken",
+    )
+    parser.add_argument(
+        "--websocket-fragment-size",
+        type=int,
+        dest="WEBSOCKET_FRAGMENT_SIZE",
+        default=default_config.WEBSOCKET_FRAGMENT_SIZE,
+        help="Largest frame payload in bytes that messages to websocket clients are "
+        "split into so pings and pongs can go out in between; 0 never splits them",
+    )
+    parser.add_argument(
+        "--websocket-compression",
+        type=boolean,
+        dest="WEBSOCKET_COMPRESSION",
+        default=default_config.WEBSOCKET_COMPRESSION,
+        help="Compress websocket messages with permessage-deflate when the client "
+        "offers it",
+    )
+    parser.add_argument(
+        "--websocket-compression-threshold",
+        type=int,
+        dest="WEBSOCKET_COMPRESSION_THRESHOLD",
+        default=default_config.WEBSOCKET_COMPRESSION_THRESHOLD,
+        help="Websocket messages smaller than this many bytes are sent uncompressed",
+    )
+    parser.add_argument(
+        "--websocket-compression-window-bits",
+        type=int,
+        dest="WEBSOCKET_COMPRESSION_WINDOW_BITS",
+        default=default_config.WEBSOCKET_COMPRESSION_WINDOW_BITS,
+        help="Largest deflate window, from 9 to 15, used in either direction; smaller "
+        "windows use less memory per connection and compress less",
+    )
+    parser.add_argument(
+        "--websocket-compression-no-context-takeover",
+        type=boolean,
+        dest="WEBSOCKET_COMPRESSION_NO_CONTEXT_TAKEOVER",
+        default=default_config.WEBSOCKET_COMPRESSION_NO_CONTEXT_TAKEOVER,
+        help="Compress each websocket message on its own instead of keeping the "
+        "compressor for the whole connection",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        dest="BACKLOG",
+        default=default_config.BACKLOG,
+        help="How many connections the kernel queues for each listening socket "
+        "before they are accepted",
+    )
+    parser.add_argument(
+        "--tcp-nodelay",
+        type=boolean,
+        dest="TCP_NODELAY",
+        default=default_config.TCP_NODELAY,
+        help="Turn off Nagle's algorithm on client connections so small writes go out "
+        "immediately",
+    )
+    parser.add_argument(
+        "--tcp-quickack",
+        type=boolean,
+        dest="TCP_QUICKACK",
+        default=default_config.TCP_QUICKACK,
+        help="Send ACKs right away instead of delaying them on new client "
+        "connections (Linux only)",
+    )
+    parser.add_argument(
+        "--tcp-defer-accept",
+        type=int,
+        dest="TCP_DEFER_ACCEPT",
+        default=default_config.TCP_DEFER_ACCEPT,
+        help="Seconds to wait for a new connection to send data before it is "
+        "accepted; 0 turns it off (Linux only)",
+    )
+    parser.add_argument(
+        "--tcp-fastopen",
+        type=int,
+        dest="TCP_FASTOPEN",
+        default=default_config.TCP_FASTOPEN,
+        help="Queue length for TCP Fast Open connections on the listening sockets; "
+        "0 turns it off",
+    )
+    parser.add_argument(
+        "--so-sndbuf",
+        type=int,
+        dest="SO_SNDBUF",
+        default=default_config.SO_SNDBUF,
+        help="Kernel send buffer size in bytes for client connections; 0 keeps the OS "
+        "default",
+    )
+    parser.add_argument(
+        "--so-rcvbuf",
+        type=int,
+        dest="SO_RCVBUF",
+        default=default_config.SO_RCVBUF,
+        help="Kernel receive buffer size in bytes for client connections; 0 keeps "
+        "the OS default",
     )
     parser.add_argument(
         "--ssl-cert-path",
@@ -106,6 +341,28 @@ def main() -> None:
         default=default_config.SSL_CIPHERS,
         help="String representing cipher suites to use in the SSLContext",
     )
+    parser.add_argument(
+        "--ssl-handshake-timeout",
+        type=float,
+        dest="SSL_HANDSHAKE_TIMEOUT",
+        default=default_config.SSL_HANDSHAKE_TIMEOUT,
+        help="How long to wait in seconds for a client to finish the TLS handshake",
+    )
+    parser.add_argument(
+        "--ssl-session-tickets",
+        type=int,
+        dest="SSL_SESSION_TICKETS",
+        default=default_config.SSL_SESSION_TICKETS,
+        help="How many TLS 1.3 session tickets to send to a client so it can resume "
+        "the session later; 0 turns resumption off",
+    )
+    parser.add_argument(
+        "--ssl-alpn-protocols",
+        type=str,
+        dest="SSL_ALPN_PROTOCOLS",
+        default=default_config.SSL_ALPN_PROTOCOLS,
+        help="Comma separated protocols to offer through ALPN",
+    )
     parser.add_argument(
         "-a",
         "--app-dir",
@@ -0,0 +1,152 @@
+import asyncio
+import errno
+import socket
+import struct
+from logging import getLogger
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple, Union
+
+from qactuar.exceptions import ClientDisconnected, MessageTooBig
+from qactuar.util import wait_readable
+from qactuar.websocket import FrameBuffers, Opcodes, encode_frames
+
+if TYPE_CHECKING:
+    from qactuar.config import Config
+    from qactuar.handlers import WebSocketHandler
+
+# asked for on every bus socket, the kernel caps it at net.core.wmem_max and the
+# largest message that can be published between processes is about this size
+BUS_BUFFER_SIZE = 1 << 22
+BUS_HEADER = struct.Struct("!BH")
+
+
+class Broadcast:
+    """
+    Groups of websockets that a message can be published to in one go, for chat
+    rooms, live feeds and the like. The message is framed once and the same frame
+    buffers are queued on every subscriber in the process. Under the prefork server
+    each process has a Unix datagram socket that every other process can write to,
+    a message published in one process is sent down each of them once and delivered
+    by the receiving processes to their own subscribers.
+    """
+
+    def __init__(self, config: "Config") -> None:
+        self.config = config
+        self.log = getLogger("qt_child")
+        self.groups: Dict[str, Set["WebSocketHandler"]] = {}
+        # one (inbox, sender) datagram socket pair per process
+        self.bus: List[Tuple[socket.socket, socket.socket]] = []
+        self.inbox: Optional[socket.socket] = None
+        self.peers: List[socket.socket] = []
+        self.listener: Optional[asyncio.Task] = None
+
+    def create_bus(self, processes: int) -> None:
+        """
+        Called before forking so that every process inherits every socket, which
+        also keeps them open for a process restarted in the same place.
+        """
+        if not hasattr(socket, "AF_UNIX") or processes < 2:
+            return
+        for _ in range(processes):
+            inbox, sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+            inbox.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, BUS_BUFFER_SIZE)
+            sender.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, BUS_BUFFER_SIZE)
+            self.bus.append((inbox, sender))
+
+    def start(self, loop: asyncio.AbstractEventLoop, index: int) -> None:
+        """
+        Connects the process at index to the bus and starts delivering what the
+        other processes publish.
+        """
+        if not self.bus:
+            return
+        self.inbox, sender = self.bus[index]
+        self.inbox.setblocking(False)
+        self.peers = [pair[1] for i, pair in enumerate(self.bus) if i != index]
+        for peer in self.peers:
+            peer.setblocking(False)
+        self.listener = loop.create_task(
+            self.listen(loop, sender.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF))
+        )
+
+    def join(self, group: str, handler: "WebSocketHandler") -> None:
+        self.groups.setdefault(group, set()).add(handler)
+        handler.groups.add(group)
+
+    def leave(self, group: str, handler: "WebSocketHandler") -> None:
+        subscribers = self.groups.get(group)
+        if subscribers is not None:
+            subscribers.discard(handler)
+            if not subscribers:
+                del self.groups[group]
+        handler.groups.discard(group)
+
+    def leave_all(self, handler: "WebSocketHandler") -> None:
+        for group in list(handler.groups):
+            self.leave(group, handler)
+
+    async def publish(self, group: str, message: Union[str, bytes]) -> None:
+        if isinstance(message, str):
+            payload, opcode = message.encode("utf-8"), Opcodes.UTF8_TEXT
+        else:
+            payload, opcode = message, Opcodes.BINARY
+        if self.peers:
+            name = group.encode("utf-8")
+            buffers = [BUS_HEADER.pack(opcode, len(name)) + name, payload]
+            for peer in self.peers:
+                self.send_to_peer(peer, buffers)
+        await self.deliver(group, opcode, payload)
+
+    def send_to_peer(self, peer: socket.socket, buffers: List[bytes]) -> None:
+        """
+        Never waits, a process that has stalled or died mustn't hold up the app that
+        is publishing. If its inbox is full the message is dropped for that process.
+        """
+        try:
+            peer.sendmsg(buffers)
+        except BlockingIOError:
+            self.log.warning("Broadcast dropped for a process with a full inbox")
+        except OSError as err:
+            if err.errno == errno.EMSGSIZE:
+                raise MessageTooBig("Message is too big to broadcast")
+            raise
+
+    async def deliver(self, group: str, opcode: int, payload: bytes) -> None:
+        """
+        Broadcasts go out uncompressed, with permessage-deflate every connection has
+        its own compression context and the frame couldn't be shared. Subscribers
+        are queued on together so one with a full send queue doesn't hold up the
+        rest, only the next broadcast.
+        """
+        subscribers = self.groups.get(group)
+        if not subscribers:
+            return
+        frames = encode_frames(payload, opcode, 0, self.config.WEBSOCKET_FRAGMENT_SIZE)
+        await asyncio.gather(
+            *(self.queue_frames(handler, frames) for handler in list(subscribers))
+        )
+
+    async def queue_frames(
+        self, handler: "WebSocketHandler", frames: List[FrameBuffers]
+    ) -> None:
+        try:
+            async with handler.send_lock:
+                await handler.queue_frames(frames)
+        except ClientDisconnected:
+            self.leave_all(handler)
+
+    async def listen(self, loop: asyncio.AbstractEventLoop, buffer_size: int) -> None:
+        if self.inbox is None:
+            return
+        buffer = bytearray(buffer_size)
+        view = memoryview(buffer)
+        while True:
+            await wait_readable(loop, self.inbox)
+            while True:
+                try:
+                    size = self.inbox.recv_into(buffer)
+                except (BlockingIOError, InterruptedError):
+                    break
+                opcode, length = BUS_HEADER.unpack_from(buffer)
+                start = BUS_HEADER.size + length
+                group = bytes(view[BUS_HEADER.size : start]).decode("utf-8")
+                await self.deliver(group, opcode, bytes(view[start:size]))
@@ -3,7 +3,7 @@ import os
 from dataclasses import dataclass, field
 from logging import getLogger
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 
 def default_log_config() -> Dict[str, Any]:
@@ -57,16 +57,48 @@ class Config:
     PORT: int = 8000
     SERVER_TYPE: str = "async_only"
     SELECT_SLEEP_TIME: float = 0.025
+    # deprecated and ignored, client sockets are non-blocking now
     RECV_TIMEOUT: float = 0.001
     RECV_BYTES: int = 65536
+    RECV_BUFFER_POOL_SIZE: int = 64
     PROCESS_POOL_SIZE: int = os.cpu_count() or 1
+    PREFORK_DISPATCH: str = "round_robin"
     REQUEST_TIMEOUT: float = 5
+    BODY_TIMEOUT: float = 30
+    BODY_TOTAL_TIMEOUT: float = 300
+    APP_TIMEOUT: float = 0
+    WRITE_TIMEOUT: float = 30
+    WEBSOCKET_IDLE_TIMEOUT: float = 60
+    WEBSOCKET_CLOSE_TIMEOUT: float = 5
+    WEBSOCKET_PING_INTERVAL: float = 20
+    WEBSOCKET_PING_TIMEOUT: float = 20
+    KEEP_ALIVE_TIMEOUT: float = 5
+    KEEP_ALIVE_MAX_REQUESTS: int = 1000
+    WEBSOCKET_MAX_FRAME_SIZE: int = 16777216
+    WEBSOCKET_MAX_MESSAGE_SIZE: int = 16777216
+    WEBSOCKET_QUEUE_SIZE: int = 64
+    WEBSOCKET_FRAGMENT_SIZE: int = 65536
+    WEBSOCKET_COMPRESSION: bool = True
+    WEBSOCKET_COMPRESSION_THRESHOLD: int = 256
+    WEBSOCKET_COMPRESSION_WINDOW_BITS: int = 15
+    WEBSOCKET_COMPRESSION_NO_CONTEXT_TAKEOVER: bool = False
+    BACKLOG: int = 65536
+    TCP_NODELAY: bool = True
+    TCP_QUICKACK: bool = False
+    TCP_DEFER_ACCEPT: int = 0
+    TCP_FASTOPEN: int = 0
+    SO_SNDBUF: int = 0
+    SO_RCVBUF: int = 0
     SSL_CERT_PATH: str = ""
     SSL_KEY_PATH: str = ""
     SSL_CIPHERS: str = "EECDH+AESGCM:EDH+AESGCM:AES256+EECDH:AES256+EDH"
+    SSL_HANDSHAKE_TIMEOUT: float = 10
+    SSL_SESSION_TICKETS: int = 2
+    SSL_ALPN_PROTOCOLS: str = "http/1.1"
     APP_DIR: str = "."
     USE_UVLOOP: bool = True
 
+    BIND: List[str] = field(default_factory=list)
     APPS: Dict[str, str] = field(default_factory=dict)
     LOGS: Dict[str, Any] = field(default_factory=default_log_config)
 
@@ -12,3 +12,11 @@ class RouteNotFoundError(QactuarException):
 
 class WebSocketError(QactuarException):
     pass
+
+
+class ClientDisconnected(QactuarException):
+    pass
+
+
+class MessageTooBig(WebSocketError):
+    pass
@@ -1,13 +1,26 @@
+import asyncio
+import os
 from base64 import standard_b64encode
 from enum import Enum, auto
 from hashlib import sha1
-from typing import TYPE_CHECKING, Optional
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
-from qactuar.exceptions import WebSocketError
+from qactuar.exceptions import ClientDisconnected, HTTPError, WebSocketError
 from qactuar.models import Message, Scope
 from qactuar.request import Request
 from qactuar.response import Response
-from qactuar.websocket import WebSocket
+from qactuar.websocket import FrameBuffers, PerMessageDeflate, WebSocket
 
 if TYPE_CHECKING:
     from qactuar.servers.base import BaseQactuarServer
@@ -16,12 +29,39 @@ ASGI_VERSION = {"version": "2.0", "spec_version": "2.0"}
 MAGIC_STRING = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
 
 
+def message_content(data: Message) -> Union[str, bytes]:
+    if data.get("bytes") is not None:
+        return data["bytes"]
+    if data.get("text") is not None:
+        return data["text"]
+    raise WebSocketError("Must provide a bytes key and/or a text key, not neither")
+
+
 class Handler:
     def __init__(self, server: "BaseQactuarServer", request: Request = None):
         self.server = server
         self._request: Request = request or Request()
         self._response: Response = Response(request=self._request)
-        self.closing = False
+        self.client_info: Tuple[str, int] = server.client_info
+        self._closing = False
+        self._closed: Optional[asyncio.Future] = None
+
+    @property
+    def closing(self) -> bool:
+        return self._closing
+
+    @closing.setter
+    def closing(self, closing: bool) -> None:
+        self._closing = closing
+        if closing and self._closed and not self._closed.done():
+            self._closed.set_result(None)
+
+    async def wait_closed(self) -> None:
+        if self._closing:
+            return
+        if self._closed is None:
+            self._closed = asyncio.get_event_loop().create_future()
+        await self._closed
 
     @property
     def request(self) -> Request:
@@ -55,35 +95,171 @@ class Handler:
             "path": self.request.path,
             "raw_path": self.request.raw_path,
             "query_string": self.request.query_string,
-            "root_path": "",
+            "root_path": self.request.root_path,
             "headers": self.request.raw_headers,
-            "client": self.server.client_info,
+            "client": self.client_info,
             "server": (self.server.server_name, self.server.server_port),
         }
 
 
 class HTTPHandler(Handler):
+    def __init__(self, server: "BaseQactuarServer", request: Request = None):
+        super().__init__(server, request)
+        self.body_reader: Optional[Callable[[], Awaitable[Tuple[bytes, bool]]]] = None
+        self.writer: Optional[Callable[[Sequence[bytes]], Awaitable[None]]] = None
+        self.file_writer: Optional[Callable[[Any, int, int], Awaitable[None]]] = None
+        self.more_body = True
+        self.body_requested = False
+        self.keep_alive = False
+        self.chunked = False
+        self.response_started = False
+        self.response_complete = False
+
+    def create_scope(self) -> Scope:
+        scope = super().create_scope()
+        scope["extensions"] = {
+            "http.response.pathsend": {},
+            "http.response.zerocopysend": {},
+            "qactuar.broadcast": {},
+        }
+        return scope
+
+    @property
+    def awaiting_continue(self) -> bool:
+        expect = self.request.headers["expect"] or ""
+        return expect.lower() == "100-continue" and not self.body_requested
+
     async def receive(self) -> Message:
-        # TODO: support streaming from client
-        if self.closing:
-            return {
-                "type": "http.disconnect",
-            }
-        else:
-            return {
-                "type": "http.request",
-                "body": self.request.body,
-                "more_body": False,
-            }
+        if not self.closing and self.more_body:
+            body = b""
+            if self.body_reader and self.awaiting_continue and self.response_started:
+                # too late for a 100 Continue, the client won't send the body now and
+                # prepare_headers has already made sure the connection gets closed
+                self.closing = True
+            elif self.body_reader:
+                try:
+                    if self.awaiting_continue and self.writer:
+                        await self.writer([b"HTTP/1.1 100 Continue\r\n\r\n"])
+                    self.body_requested = True
+                    body, self.more_body = await self.body_reader()
+                except (ClientDisconnected, HTTPError, OSError):
+                    # a malformed body is the client's problem, not the app's, and
+                    # whatever is left of it can't be skipped to reuse the connection
+                    self.keep_alive = False
+                    self.closing = True
+            else:
+                body, self.more_body = self.request.body, False
+            if not self.closing:
+                return {
+                    "type": "http.request",
+                    "body": body,
+                    "more_body": self.more_body,
+                }
+        await self.wait_closed()
+        return {
+            "type": "http.disconnect",
+        }
 
     async def send(self, data: Message) -> None:
         if data["type"] == "http.response.start":
             self.response.status = str(data["status"]).encode("utf-8")
             self.response.headers += data["headers"]
         if data["type"] == "http.response.body":
-            # TODO: check "more_body" and if true then do
-            #  self.server.client_connection.send() to send the current data
-            self.response.body.write(data["body"])
+            body = data.get("body", b"")
+            more_body = data.get("more_body", False)
+            if self.writer is None:
+                self.response.body.write(body)
+                return
+            await self.write_body(body, more_body)
+        if data["type"] == "http.response.pathsend":
+            with open(data["path"], "rb") as file:
+                await self.write_file(file, 0, None, False)
+        if data["type"] == "http.response.zerocopysend":
+            await self.write_file(
+                data["file"],
+                data.get("offset"),
+                data.get("count"),
+                data.get("more_body", False),
+            )
+        if data["type"] == "qactuar.broadcast.publish":
+            await self.server.broadcast.publish(data["group"], message_content(data))
+
+    async def write_body(self, body: bytes, more_body: bool) -> None:
+        if self.response_complete or self.writer is None:
+            return
+        prefix, suffix = self.frame_body(len(body), more_body)
+        if body and self.response.has_body(self.request.method):
+            prefix.append(body)
+        if prefix or suffix:
+            await self.writer(prefix + suffix)
+
+    async def write_file(
+        self, file: Any, offset: Optional[int], count: Optional[int], more_body: bool
+    ) -> None:
+        if offset is None:
+            offset = file.tell()
+        if count is None:
+            count = os.fstat(file.fileno()).st_size - offset
+        if self.writer is None or self.file_writer is None:
+            file.seek(offset)
+            self.response.body.write(file.read(count))
+            return
+        if self.response_complete:
+            return
+        prefix, suffix = self.frame_body(count, more_body)
+        if prefix:
+            await self.writer(prefix)
+        if count and self.response.has_body(self.request.method):
+            await self.file_writer(file, offset, count)
+        if suffix:
+            await self.writer(suffix)
+
+    def frame_body(
+        self, length: int, more_body: bool
+    ) -> Tuple[List[bytes], List[bytes]]:
+        prefix: List[bytes] = []
+        suffix: List[bytes] = []
+        if not self.response_started:
+            self.prepare_headers(length, more_body)
+            prefix.append(self.response.head())
+            self.response_started = True
+        if self.chunked and self.response.has_body(self.request.method):
+            if length:
+                prefix.append(b"%x\r\n" % length)
+                suffix.append(b"\r\n")
+            if not more_body:
+                suffix.append(b"0\r\n\r\n")
+        if not more_body:
+            self.response_complete = True
+        return prefix, suffix
+
+    def prepare_headers(self, length: int, more_body: bool) -> None:
+        response = self.response
+        if self.more_body and self.awaiting_continue:
+            # the client never got to send the body so the connection can't be reused
+            self.keep_alive = False
+        transfer_encoding = response.get_header(b"transfer-encoding") or b""
+        if b"chunked" in transfer_encoding.lower():
+            self.chunked = True
+        elif response.get_header(b"content-length") is None and response.has_body(
+            self.request.method
+        ):
+            if not more_body:
+                response.add_header("Content-Length", str(length))
+            elif self.request.request_version_num == "1.0":
+                # no way to mark the end of the body other than closing
+                self.keep_alive = False
+            else:
+                response.add_header("Transfer-Encoding", "chunked")
+                self.chunked = True
+        connection = response.get_header(b"connection") or b""
+        if b"close" in connection.lower():
+            self.keep_alive = False
+        elif not connection:
+            response.add_header(
+                "Connection", "keep-alive" if self.keep_alive else "close"
+            )
+        response.add_header("x-request-id", self.request.request_id)
 
 
 class WebSocketState(Enum):
@@ -109,65 +285,164 @@ class WebSocketState(Enum):
 
 
 class WebSocketHandler(Handler):
+    """
+    The app runs for as long as the connection is open. Messages from the client are
+    put on receive_queue by the process's reader and frames the app sends go on
+    send_queue for its writer, so both directions flow independently of each other.
+    Both queues are bounded, a full one makes the side filling it wait.
+    """
+
     def __init__(self, server: "BaseQactuarServer"):
         super().__init__(server)
+        config = server.config
         self.state = WebSocketState.INIT
-        self.websocket: Optional[WebSocket] = None
+        self.state_changed = asyncio.Event()
+        self.accepted = False
+        self.websocket = WebSocket(
+            config.WEBSOCKET_MAX_FRAME_SIZE,
+            config.WEBSOCKET_MAX_MESSAGE_SIZE,
+            config.WEBSOCKET_FRAGMENT_SIZE,
+        )
+        self.receive_queue: "asyncio.Queue[Message]" = asyncio.Queue(
+            config.WEBSOCKET_QUEUE_SIZE
+        )
+        # one frame per item, None tells the writer there is nothing more to send
+        self.send_queue: "asyncio.Queue[Optional[FrameBuffers]]" = asyncio.Queue(
+            config.WEBSOCKET_QUEUE_SIZE
+        )
+        # keeps the fragments of one message from being interleaved with another's
+        self.send_lock = asyncio.Lock()
+        self.receive_queue.put_nowait({"type": "websocket.connect"})
+        self.ping_payload = b""
+        self.pong_waiter: Optional[asyncio.Future] = None
+        # broadcast groups the connection has joined
+        self.groups: Set[str] = set()
 
     def create_scope(self) -> Scope:
         scope = super().create_scope()
-        scope["subprotocols"] = []
+        del scope["method"]
+        scope["type"] = "websocket"
+        scope["scheme"] = "wss" if self.server.scheme == "https" else "ws"
+        protocols = self.request.headers["sec-websocket-protocol"] or ""
+        scope["subprotocols"] = [
+            protocol.strip() for protocol in protocols.split(",") if protocol.strip()
+        ]
+        scope["extensions"] = {"qactuar.broadcast": {}}
         return scope
 
     async def receive(self) -> Message:
-        if self.state == WebSocketState.INIT:
-            return {"type": "websocket.connect"}
-        if self.state == WebSocketState.ACCEPTED:
-            byte_message = b""
-            text_message = ""
-            if self.websocket:
-                if self.websocket.is_text and self.websocket.response:
-                    text_message = self.websocket.response.decode("utf-8")
-                elif self.websocket.response:
-                    byte_message = self.websocket.response
-            return {
-                "type": "websocket.receive",
-                "bytes": byte_message or None,
-                "text": text_message or None,
-            }
-        if self.state == WebSocketState.DISCONNECTED:
-            diconnect_code = 1000
-            if self.websocket:
-                diconnect_code = self.websocket.diconnect_code
-            return {
-                "type": "websocket.disconnect",
-                "code": diconnect_code,
-            }
-        raise WebSocketError("Unexpected WebSocket state")
+        if self.state == WebSocketState.DISCONNECTED and self.receive_queue.empty():
+            return self.disconnect_message()
+        return await self.receive_queue.get()
 
     async def send(self, data: Message) -> None:
         if data["type"] == "websocket.accept":
-            if self.websocket:
-                self.websocket.subprotocol = data["subprotocol"]
-                for header_name, header_value in data["headers"]:
-                    if header_name == "sec-websocket-protocol":
-                        header_name = "subprotocol"
-                    self.websocket.headers[header_name] = header_value
-            self.state = WebSocketState.ACCEPTED
-        if data["type"] == "websocket.close":
-            if self.websocket:
-                self.websocket.diconnect_code = data["code"]
-            self.state = WebSocketState.DISCONNECTED
-        if data["type"] == "websocket.send":
-            if self.websocket:
-                if "bytes" in data and data["bytes"]:
-                    self.websocket.write(data["bytes"])
-                elif "text" in data and data["text"]:
-                    self.websocket.write(data["text"])
-                else:
-                    raise WebSocketError(
-                        "Must provide a bytes key and/or a text key, not neither"
-                    )
+            if self.state != WebSocketState.INIT:
+                raise WebSocketError("WebSocket has already been accepted or closed")
+            self.websocket.subprotocol = data.get("subprotocol") or ""
+            if self.websocket.subprotocol:
+                self.response.add_header(
+                    "Sec-WebSocket-Protocol", self.websocket.subprotocol
+                )
+            self.response.headers += data.get("headers", [])
+            self.accepted = True
+            self.set_state(WebSocketState.ACCEPTED)
+        elif data["type"] == "websocket.close":
+            if self.state == WebSocketState.INIT:
+                # rejected before the handshake, it's answered with a 403
+                self.set_state(WebSocketState.DISCONNECTED)
+            else:
+                await self.close(data.get("code", 1000), data.get("reason") or "")
+        elif data["type"] == "websocket.send":
+            if self.state != WebSocketState.ACCEPTED:
+                raise ClientDisconnected("WebSocket is not open")
+            message = message_content(data)
+            async with self.send_lock:
+                # compression has to happen in the order the messages are sent
+                await self.queue_frames(self.websocket.write(message))
+        elif data["type"] == "qactuar.broadcast.join":
+            if self.state != WebSocketState.ACCEPTED:
+                raise ClientDisconnected("WebSocket is not open")
+            self.server.broadcast.join(data["group"], self)
+        elif data["type"] == "qactuar.broadcast.leave":
+            self.server.broadcast.leave(data["group"], self)
+        elif data["type"] == "qactuar.broadcast.publish":
+            await self.server.broadcast.publish(data["group"], message_content(data))
+
+    async def queue_frames(self, frames: List[FrameBuffers]) -> None:
+        """
+        Puts the frames of one message on the send queue, the caller holds send_lock.
+        """
+        for frame in frames:
+            if self.state != WebSocketState.ACCEPTED:
+                raise ClientDisconnected("WebSocket is not open")
+            # control frames can go out in between the fragments
+            await self.send_queue.put(frame)
+
+    def set_state(self, state: WebSocketState) -> None:
+        self.state = state
+        self.state_changed.set()
+
+    def disconnect_message(self) -> Message:
+        return {"type": "websocket.disconnect", "code": self.websocket.diconnect_code}
+
+    async def push_message(self, message: Union[str, bytes]) -> None:
+        if self.state != WebSocketState.ACCEPTED:
+            return
+        if isinstance(message, str):
+            await self.receive_queue.put(
+                {"type": "websocket.receive", "bytes": None, "text": message}
+            )
+        else:
+            await self.receive_queue.put(
+                {"type": "websocket.receive", "bytes": message, "text": None}
+            )
+
+    async def ping(self) -> "asyncio.Future[None]":
+        """
+        Queues a ping with a random payload. The returned future is done once the
+        pong answering it arrives.
+        """
+        self.ping_payload = os.urandom(4)
+        self.pong_waiter = asyncio.get_event_loop().create_future()
+        if self.state == WebSocketState.ACCEPTED:
+            for frame in self.websocket.write(self.ping_payload, ping=True):
+                await self.send_queue.put(frame)
+        return self.pong_waiter
+
+    def pong_received(self, payload: bytes) -> None:
+        # a pong for an earlier ping or an unsolicited one doesn't count
+        if self.pong_waiter and not self.pong_waiter.done():
+            if payload == self.ping_payload:
+                self.pong_waiter.set_result(None)
+
+    async def close(self, code: int, reason: str = "") -> None:
+        """
+        Queues a close frame and then the end of the output. Only the first call does
+        anything, whichever side starts the closing handshake.
+        """
+        if self.state == WebSocketState.DISCONNECTED:
+            return
+        self.set_state(WebSocketState.DISCONNECTED)
+        self.websocket.diconnect_code = code
+        for frame in self.websocket.write(
+            reason, terminate=True, close_status_code=code
+        ):
+            await self.send_queue.put(frame)
+        await self.send_queue.put(None)
+
+    def disconnected(self, code: int) -> None:
+        """
+        Called once the connection is closed. Wakes an app waiting on receive() with
+        a websocket.disconnect and one waiting for room on the send queue.
+        """
+        if self.state != WebSocketState.DISCONNECTED:
+            self.set_state(WebSocketState.DISCONNECTED)
+            self.websocket.diconnect_code = code
+        if not self.receive_queue.full():
+            self.receive_queue.put_nowait(self.disconnect_message())
+        while not self.send_queue.empty():
+            self.send_queue.get_nowait()
 
     def ws_shake_hand(self) -> None:
         websocket_key = self.request.headers["sec-websocket-key"]
@@ -179,6 +454,25 @@ class WebSocketHandler(Handler):
             self.response.add_header("Upgrade", "websocket")
             self.response.add_header("Connection", "Upgrade")
             self.response.add_header("Sec-WebSocket-Accept", websocket_accept)
+            self.negotiate_compression()
+
+    def negotiate_compression(self) -> None:
+        config = self.server.config
+        offers = self.request.headers["sec-websocket-extensions"]
+        if not config.WEBSOCKET_COMPRESSION or not offers:
+            return
+        deflate = PerMessageDeflate.negotiate(
+            offers,
+            config.WEBSOCKET_COMPRESSION_WINDOW_BITS,
+            config.WEBSOCKET_COMPRESSION_NO_CONTEXT_TAKEOVER,
+            config.WEBSOCKET_COMPRESSION_THRESHOLD,
+            config.WEBSOCKET_MAX_MESSAGE_SIZE,
+        )
+        if deflate:
+            self.websocket.use_deflate(deflate)
+            self.response.add_header(
+                "Sec-WebSocket-Extensions", deflate.response_header
+            )
 
 
 class LifespanHandler(Handler):
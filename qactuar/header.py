@@ -1,32 +1,99 @@
-from typing import Dict, Optional, Union
+from typing import Iterator, List, Optional, Tuple, Union
 
 from qactuar.models import Headers
 
+HeaderName = Union[str, bytes]
+HeaderValue = Union[str, bytes, int]
+
+
+def _to_name(name: HeaderName) -> bytes:
+    if isinstance(name, str):
+        name = name.encode("latin-1")
+    return name.lower()
+
+
+def _to_value(value: HeaderValue) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
 
 class Header:
+    """
+    Case-insensitive multi-map over raw (name, value) byte pairs, the names keep the
+    case they were given in. Nothing is decoded up front, a value is only turned
+    into a str when it is looked up and repeated headers (Cookie, Forwarded, etc.)
+    are all kept. Looking up a repeated header joins the values the way RFC 7230
+    says they can be combined.
+    """
+
+    __slots__ = ("_header",)
+
     def __init__(self, header: Headers = None):
         if header is None:
             header = []
         self._header = header
-        self._header_attrs: Dict[str, str] = {}
-        self.decode()
 
-    def __contains__(self, item: str) -> bool:
-        if item in self._header_attrs:
-            return True
+    def __contains__(self, item: HeaderName) -> bool:
+        name = _to_name(item)
+        for key, _ in self._header:
+            if key.lower() == name:
+                return True
         return False
 
-    def __getitem__(self, item: str) -> Optional[str]:
-        if item in self._header_attrs:
-            return self._header_attrs[item]
-        return None
+    def __getitem__(self, item: HeaderName) -> Optional[str]:
+        value = self.get_raw(item)
+        if value is None:
+            return None
+        return value.decode("utf-8", "replace")
+
+    def __setitem__(self, key: HeaderName, value: HeaderValue) -> None:
+        del self[key]
+        self.add(key, value)
 
-    def __setitem__(self, key: str, value: Union[str, int]) -> None:
-        self._header_attrs[key] = str(value)
+    def __delitem__(self, key: HeaderName) -> None:
+        name = _to_name(key)
+        self._header[:] = [
+            header for header in self._header if header[0].lower() != name
+        ]
+
+    def __iter__(self) -> Iterator[Tuple[bytes, bytes]]:
+        return iter(self._header)
+
+    def __len__(self) -> int:
+        return len(self._header)
+
+    def add(self, key: HeaderName, value: HeaderValue) -> None:
+        self._header.append((_to_name(key), _to_value(value)))
+
+    def get_raw(self, item: HeaderName) -> Optional[bytes]:
+        values = self.get_all_raw(item)
+        if not values:
+            return None
+        if len(values) == 1:
+            return values[0]
+        separator = b"; " if _to_name(item) == b"cookie" else b", "
+        return separator.join(values)
+
+    def get_all_raw(self, item: HeaderName) -> List[bytes]:
+        name = _to_name(item)
+        return [value for key, value in self._header if key.lower() == name]
+
+    def has_token(self, item: HeaderName, token: HeaderName) -> bool:
+        """
+        For comma separated headers like Connection, checks if any of the values
+        contain the token, ignoring case.
+        """
+        token = _to_name(token)
+        for value in self.get_all_raw(item):
+            for part in value.split(b","):
+                if part.strip().lower() == token:
+                    return True
+        return False
 
-    def __delitem__(self, key: str) -> None:
-        del self._header_attrs[key]
+    def get_all(self, item: HeaderName) -> List[str]:
+        return [value.decode("utf-8", "replace") for value in self.get_all_raw(item)]
 
-    def decode(self) -> None:
-        for key, value in self._header:
-            self._header_attrs[key.decode("utf-8")] = value.decode("utf-8")
+    @property
+    def raw(self) -> Headers:
+        return self._header
@@ -0,0 +1,200 @@
+from enum import Enum, auto
+from string import hexdigits
+from typing import List, Optional, Union
+
+from qactuar.exceptions import HTTPError
+from qactuar.request import Request
+from qactuar.util import ByteBuffer
+
+MAX_HEAD_SIZE = 65536
+MAX_CHUNK_LINE_SIZE = 4096
+HEXDIGITS = frozenset(hexdigits.encode())
+
+
+def parse_content_length(values: List[bytes]) -> int:
+    """
+    Content-Length has to be plain digits, int() would also take a sign, spaces and
+    underscores. Repeats of the header, or a list in one, are only allowed if they
+    all agree.
+    """
+    lengths = {part.strip(b" \t") for value in values for part in value.split(b",")}
+    if len(lengths) != 1:
+        raise HTTPError(400)
+    length = lengths.pop()
+    if not length.isdigit():
+        raise HTTPError(400)
+    return int(length)
+
+
+def parse_chunk_size(line: bytes) -> int:
+    size = line.split(b";", 1)[0].rstrip(b" \t")
+    if not size or not HEXDIGITS.issuperset(size):
+        raise HTTPError(400)
+    return int(size, 16)
+
+
+class ParserState(Enum):
+    HEAD = auto()
+    BODY = auto()
+    CHUNK_SIZE = auto()
+    CHUNK_DATA = auto()
+    CHUNK_END = auto()
+    TRAILERS = auto()
+    COMPLETE = auto()
+
+
+class RequestParser:
+    """
+    Incremental HTTP/1.1 request parser. Bytes are handed to feed() as they come off
+    the socket and only the new bytes are looked at, the request line and headers are
+    parsed as soon as the blank line after them arrives and body bytes are collected
+    as they come in, whether framed by Content-Length or chunked transfer encoding.
+    Anything received past the end of the request is kept for the next one on the
+    connection.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = ByteBuffer()
+        self._pos = 0
+        self._scanned = 0
+        self._body_chunks: List[bytes] = []
+        self._remaining = 0
+        self.state = ParserState.HEAD
+        self.request = Request()
+
+    @property
+    def headers_complete(self) -> bool:
+        return self.state != ParserState.HEAD
+
+    @property
+    def complete(self) -> bool:
+        return self.state == ParserState.COMPLETE
+
+    @property
+    def has_buffered_data(self) -> bool:
+        return len(self._buffer) > 0
+
+    def feed(self, data: Union[bytes, memoryview]) -> None:
+        self._buffer.write(data)
+        while self.state != ParserState.COMPLETE and self._parse_next():
+            pass
+        if self._pos:
+            self._buffer.consume(self._pos)
+            self._scanned = max(0, self._scanned - self._pos)
+            self._pos = 0
+
+    def take_body(self) -> bytes:
+        body = b"".join(self._body_chunks)
+        self._body_chunks = []
+        return body
+
+    def take_buffered(self) -> bytes:
+        """
+        Hands over whatever was received past the end of the request, for when the
+        connection stops speaking HTTP after an upgrade.
+        """
+        data = self._buffer.read()
+        self._buffer.clear()
+        self._scanned = 0
+        return data
+
+    def reset(self) -> None:
+        self._body_chunks = []
+        self._remaining = 0
+        self._scanned = 0
+        self.state = ParserState.HEAD
+        self.request = Request()
+
+    def _parse_next(self) -> bool:
+        if self.state == ParserState.HEAD:
+            return self._parse_head()
+        if self.state == ParserState.BODY:
+            return self._parse_body()
+        if self.state == ParserState.CHUNK_SIZE:
+            return self._parse_chunk_size()
+        if self.state == ParserState.CHUNK_DATA:
+            return self._parse_body()
+        if self.state == ParserState.CHUNK_END:
+            return self._parse_chunk_end()
+        if self.state == ParserState.TRAILERS:
+            return self._parse_trailers()
+        return False
+
+    def _find_line(self, max_size: int) -> Optional[int]:
+        end = self._buffer.find(b"\r\n", self._pos)
+        # a whole line can arrive in one read, so check it as well as a partial one
+        if (len(self._buffer) if end == -1 else end) - self._pos > max_size:
+            raise HTTPError(400)
+        return None if end == -1 else end
+
+    def _parse_head(self) -> bool:
+        while self._buffer.startswith(b"\r\n", self._pos):
+            self._pos += 2
+        # only look through bytes that haven't been searched by a previous feed
+        end = self._buffer.find(b"\r\n\r\n", max(self._pos, self._scanned - 3))
+        if end == -1:
+            if len(self._buffer) - self._pos > MAX_HEAD_SIZE:
+                raise HTTPError(431)
+            self._scanned = len(self._buffer)
+            return False
+        if end - self._pos > MAX_HEAD_SIZE:
+            raise HTTPError(431)
+        try:
+            self.request.parse_head(bytes(self._buffer.view(self._pos, end)))
+        except ValueError:
+            raise HTTPError(400)
+        self._pos = end + 4
+
+        transfer_encoding = self.request.headers["transfer-encoding"]
+        content_length = self.request.headers.get_all_raw("content-length")
+        if transfer_encoding and "chunked" in transfer_encoding.lower():
+            self.state = ParserState.CHUNK_SIZE
+        elif content_length:
+            self._remaining = parse_content_length(content_length)
+            self.state = ParserState.BODY if self._remaining else ParserState.COMPLETE
+        else:
+            self.state = ParserState.COMPLETE
+        return True
+
+    def _parse_body(self) -> bool:
+        available = len(self._buffer) - self._pos
+        if not available:
+            return False
+        size = min(available, self._remaining)
+        self._body_chunks.append(bytes(self._buffer.view(self._pos, self._pos + size)))
+        self._pos += size
+        self._remaining -= size
+        if not self._remaining:
+            if self.state == ParserState.CHUNK_DATA:
+                self.state = ParserState.CHUNK_END
+            else:
+                self.state = ParserState.COMPLETE
+        return True
+
+    def _parse_chunk_size(self) -> bool:
+        end = self._find_line(MAX_CHUNK_LINE_SIZE)
+        if end is None:
+            return False
+        self._remaining = parse_chunk_size(bytes(self._buffer.view(self._pos, end)))
+        self._pos = end + 2
+        self.state = ParserState.CHUNK_DATA if self._remaining else ParserState.TRAILERS
+        return True
+
+    def _parse_chunk_end(self) -> bool:
+        if len(self._buffer) - self._pos < 2:
+            return False
+        if not self._buffer.startswith(b"\r\n", self._pos):
+            raise HTTPError(400)
+        self._pos += 2
+        self.state = ParserState.CHUNK_SIZE
+        return True
+
+    def _parse_trailers(self) -> bool:
+        end = self._find_line(MAX_HEAD_SIZE)
+        if end is None:
+            return False
+        is_last_line = end == self._pos
+        self._pos = end + 2
+        if is_last_line:
+            self.state = ParserState.COMPLETE
+        return True
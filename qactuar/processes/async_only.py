@@ -14,10 +14,15 @@ class AsyncOnlyChild(BaseProcessHandler):
     async def start(self, client_socket: socket.socket = None) -> None:
         if not client_socket:
             return
-        client_socket = self.setup_ssl(client_socket)
-        await self.handle_request(client_socket)
+        connection = await self.setup_ssl(client_socket)
+        if connection:
+            await self.handle_request(connection)
 
 
 async def make_child(server: "AsyncOnlyServer", client_socket: socket.socket) -> None:
     child = AsyncOnlyChild(server)
-    await child.start(client_socket)
+    try:
+        await child.start(client_socket)
+    except Exception as err:
+        child.exception_log.exception(err)
+        client_socket.close()
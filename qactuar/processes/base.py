@@ -1,17 +1,28 @@
+import asyncio
 import socket
-import ssl
-from io import BytesIO
+from functools import partial
 from logging import getLogger
-from random import randint
-from time import time
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, Sequence, Tuple, Union
 
-from qactuar.exceptions import HTTPError, WebSocketError
-from qactuar.handlers import HTTPHandler, WebSocketHandler, WebSocketState
+from qactuar.exceptions import (
+    ClientDisconnected,
+    HTTPError,
+    MessageTooBig,
+    WebSocketError,
+)
+from qactuar.handlers import HTTPHandler, WebSocketHandler
+from qactuar.parser import RequestParser
 from qactuar.request import Request
 from qactuar.response import Response
-from qactuar.util import BytesList, create_event_loop
-from qactuar.websocket import Frame, WebSocket
+from qactuar.util import (
+    create_event_loop,
+    sock_recv_into,
+    sock_sendall,
+    sock_sendfile,
+    sock_sendmsg,
+    ssl_call,
+)
+from qactuar.websocket import Frame, Opcodes, WebSocket
 
 if TYPE_CHECKING:
     from qactuar import ASGIApp
@@ -29,45 +40,60 @@ class BaseProcessHandler:
         self.exception_log = getLogger("qt_exception")
 
     def get_app(self, request: Request) -> "ASGIApp":
-        current_path = request.path
-        for route, app in self.server.apps.items():
-            if route == "/":
-                if current_path == route:
-                    return app
-            elif current_path.startswith(route):
-                request.path = current_path.replace(route, "")
-                return app
-        try:
-            app = self.server.apps["/"]
-        except KeyError:
+        match = self.server.router.match(request.path)
+        if match is None:
             raise HTTPError(404)
-        else:
-            return app
+        app, request.root_path = match
+        return app
 
-    def setup_ssl(self, client_socket: socket.socket) -> socket.socket:
-        if self.server.ssl_context:
-            ssl_socket = self.server.ssl_context.wrap_socket(
-                client_socket, server_side=True, do_handshake_on_connect=False
+    async def setup_ssl(self, client_socket: socket.socket) -> Optional[socket.socket]:
+        """
+        Does the TLS handshake on the event loop so that a slow client only holds up
+        its own connection. Returns None when the handshake fails or takes longer
+        than SSL_HANDSHAKE_TIMEOUT, the socket has been closed by then.
+        """
+        client_socket.setblocking(False)
+        if not self.server.ssl_context:
+            return client_socket
+        ssl_socket = self.server.ssl_context.wrap_socket(
+            client_socket, server_side=True, do_handshake_on_connect=False
+        )
+        try:
+            await asyncio.wait_for(
+                ssl_call(self.loop, ssl_socket, ssl_socket.do_handshake),
+                self.server.config.SSL_HANDSHAKE_TIMEOUT,
             )
-            try:
-                ssl_socket.do_handshake()
-            except ssl.SSLError as err:
-                if err.args[1].find("sslv3 alert") == -1:
-                    self.exception_log.exception(err)
-                    raise HTTPError(403)
-                else:
-                    client_socket = ssl_socket
-            else:
-                client_socket = ssl_socket
-        client_socket.settimeout(self.server.config.RECV_TIMEOUT)
-        return client_socket
+        except asyncio.TimeoutError:
+            self.child_log.debug("TLS handshake timed out")
+            ssl_socket.close()
+            return None
+        except OSError as err:
+            # covers ssl.SSLError, clients that don't trust the certificate abort here
+            self.child_log.debug(f"TLS handshake failed: {err}")
+            ssl_socket.close()
+            return None
+        return ssl_socket
 
-    def log_access(self, request: Request, response: Response) -> None:
+    @staticmethod
+    def get_client_info(client_socket: socket.socket) -> Tuple[str, int]:
+        try:
+            peer = client_socket.getpeername()
+        except OSError:
+            return "", 0
+        if isinstance(peer, tuple):
+            # IPv6 addresses also have flowinfo and scope id
+            return peer[0], peer[1]
+        # unix domain socket peers don't have an address
+        return "", 0
+
+    def log_access(
+        self, request: Request, response: Response, client_info: Tuple[str, int]
+    ) -> None:
         self._access_log.info(
             "",
             extra={
-                "host": self.server.client_info[0],
-                "port": self.server.client_info[1],
+                "host": client_info[0],
+                "port": client_info[1],
                 "request_id": request.request_id,
                 "method": request.method,
                 "http_version": request.request_version_num,
@@ -77,182 +103,444 @@ class BaseProcessHandler:
         )
 
     async def handle_request(self, client_socket: socket.socket) -> None:
-        request = await self.get_request_data(client_socket)
-        http_handler = HTTPHandler(self.server, request)
-        if not request.raw_request:
-            await self.close_socket(client_socket, http_handler)
-            return
+        config = self.server.config
+        timeout = config.REQUEST_TIMEOUT
+        parser = RequestParser()
+        request_count = 0
+        keep_alive = True
+        while keep_alive:
+            request_count += 1
+            keep_alive = await self.serve_request(
+                client_socket,
+                parser,
+                timeout,
+                request_count < config.KEEP_ALIVE_MAX_REQUESTS,
+            )
+            parser.reset()
+            timeout = config.KEEP_ALIVE_TIMEOUT
+        client_socket.close()
+
+    async def serve_request(
+        self,
+        client_socket: socket.socket,
+        parser: RequestParser,
+        timeout: float,
+        allow_keep_alive: bool,
+    ) -> bool:
+        http_handler = HTTPHandler(self.server)
+        http_handler.client_info = self.get_client_info(client_socket)
+        http_handler.writer = partial(self.send_buffers, client_socket)
+        http_handler.file_writer = partial(self.send_file, client_socket)
         try:
-            if (
-                request.headers["connection"] == "Upgrade"
-                and request.headers["upgrade"] == "websocket"
-            ):
-                await self.websocket_loop(client_socket, http_handler)
-                # http_handler.response.clear()
-                return
+            http_handler.request = await self.get_request_data(
+                client_socket, parser, timeout
+            )
+        except HTTPError as err:
+            self.set_error_response(http_handler, err.args[0])
+            return await self.finish_response(http_handler)
+        request = http_handler.request
+        if not parser.headers_complete:
+            http_handler.closing = True
+            return False
+        body_timeout = self.server.config.BODY_TOTAL_TIMEOUT
+        body_deadline = self.loop.time() + body_timeout if body_timeout else None
+        http_handler.body_reader = partial(
+            self.read_body_chunk, client_socket, parser, body_deadline
+        )
+        http_handler.keep_alive = allow_keep_alive and self.should_keep_alive(request)
+        try:
+            if self.is_websocket_upgrade(request):
+                await self.websocket_loop(
+                    client_socket, http_handler, parser.take_buffered()
+                )
+                return False
             await self.send_to_app(http_handler)
         except HTTPError as err:
-            http_handler.response.status = str(err.args[0]).encode("utf-8")
-            http_handler.response.body.write(str(err.args[0]).encode("utf-8"))
+            self.set_error_response(http_handler, err.args[0])
+        except (ConnectionError, socket.timeout) as err:
+            # the client went away or stopped reading part way through the response
+            self.child_log.debug(f"{request.request_id} {err}")
+            self.set_error_response(http_handler, 500, b"Internal Server Error")
         except Exception as err:
             self.exception_log.exception(err, extra={"request_id": request.request_id})
-            http_handler.response.status = b"500"
-            http_handler.response.body.write(b"Internal Server Error")
+            self.set_error_response(http_handler, 500, b"Internal Server Error")
         finally:
             if http_handler.response:
-                self.log_access(request, http_handler.response)
-            await self.finish_response(client_socket, http_handler)
+                self.log_access(
+                    request, http_handler.response, http_handler.client_info
+                )
+        keep_alive = await self.finish_response(http_handler)
+        if keep_alive and not parser.complete:
+            keep_alive = await self.drain_body(client_socket, parser, body_deadline)
+        return keep_alive
+
+    @staticmethod
+    def set_error_response(
+        http_handler: HTTPHandler, status: int, body: bytes = None
+    ) -> None:
+        http_handler.keep_alive = False
+        if http_handler.response_started:
+            # too late to tell the client, closing the connection is all that's left
+            return
+        http_handler.response.clear()
+        http_handler.response.status = str(status).encode("utf-8")
+        http_handler.response.body.write(body or str(status).encode("utf-8"))
+
+    @staticmethod
+    def is_websocket_upgrade(request: Request) -> bool:
+        return request.headers.has_token(
+            "connection", "upgrade"
+        ) and request.headers.has_token("upgrade", "websocket")
+
+    @staticmethod
+    def should_keep_alive(request: Request) -> bool:
+        if request.request_version_num == "1.0":
+            return request.headers.has_token("connection", "keep-alive")
+        return not request.headers.has_token("connection", "close")
 
-    async def get_request_data(self, client_socket: socket.socket) -> Request:
-        request_data = BytesList()
-        request = Request()
-        start = time()
+    async def get_request_data(
+        self, client_socket: socket.socket, parser: RequestParser, timeout: float
+    ) -> Request:
+        """
+        Reads until the request line and headers have all arrived. The timeout is
+        for the whole head rather than each read so a client trickling in a byte at a
+        time can't hold the connection open forever.
+        """
+        # bytes left over from a pipelined request may already hold the next head
+        parser.feed(b"")
+        try:
+            await asyncio.wait_for(
+                self.read_head(client_socket, parser), timeout or None
+            )
+        except asyncio.TimeoutError:
+            self.child_log.debug("timed out waiting for the request head")
+            if parser.has_buffered_data:
+                raise HTTPError(408)
+        return parser.request
 
+    async def read_head(
+        self, client_socket: socket.socket, parser: RequestParser
+    ) -> None:
+        while not parser.headers_complete:
+            try:
+                if not await self.recv_into(client_socket, parser.feed):
+                    break
+            except ConnectionError:
+                break
+
+    async def read_body_chunk(
+        self,
+        client_socket: socket.socket,
+        parser: RequestParser,
+        deadline: Optional[float] = None,
+    ) -> Tuple[bytes, bool]:
+        """
+        Hands the app whatever part of the body has arrived since the last call. The
+        socket is only read from when the app asks for more so a slow app holds the
+        client back through TCP flow control rather than the body piling up here.
+        Each read can take up to BODY_TIMEOUT and all of them together have to be
+        done by the deadline, so a client sending a byte now and then can't keep the
+        connection forever.
+        """
         while True:
+            body = parser.take_body()
+            if body or parser.complete:
+                return body, not parser.complete
+            timeout = self.server.config.BODY_TIMEOUT or None
+            if deadline is not None:
+                remaining = deadline - self.loop.time()
+                if remaining <= 0:
+                    raise ClientDisconnected("Timed out reading the request body")
+                timeout = min(timeout or remaining, remaining)
             try:
-                data = await self.loop.sock_recv(
-                    client_socket, self.server.config.RECV_BYTES
+                size = await asyncio.wait_for(
+                    self.recv_into(client_socket, parser.feed), timeout
                 )
-                request_data.write(data)
-            except socket.timeout:
-                if not len(request_data):
-                    if time() - start > self.server.config.REQUEST_TIMEOUT:
-                        self.child_log.debug(
-                            "no data received from request, timing out"
-                        )
-                        break
-            request.raw_request = request_data.read()
-            if request.headers_complete:
-                content_length = request.headers["content-length"]
-                if content_length is not None and request.method != "GET":
-                    if len(request.body) == int(content_length):
-                        break
-                    else:
-                        continue
-                break
+            except asyncio.TimeoutError:
+                raise ClientDisconnected("Timed out reading the request body")
+            except ConnectionError as err:
+                raise ClientDisconnected(str(err))
+            if not size:
+                raise ClientDisconnected("Connection closed while reading the body")
 
-        return request
+    async def drain_body(
+        self,
+        client_socket: socket.socket,
+        parser: RequestParser,
+        deadline: Optional[float] = None,
+    ) -> bool:
+        try:
+            while not parser.complete:
+                await self.read_body_chunk(client_socket, parser, deadline)
+        except (ClientDisconnected, HTTPError):
+            return False
+        return True
 
     async def send_to_app(self, http_handler: HTTPHandler) -> None:
         app = self.get_app(http_handler.request)
-        await app(
+        app_call = app(
             http_handler.create_scope(),
             http_handler.receive,
             http_handler.send,
         )
+        if not self.server.config.APP_TIMEOUT:
+            await app_call
+            return
+        # asyncio.wait rather than wait_for so that a TimeoutError raised by the app
+        # itself isn't mistaken for the app running out of time
+        # the app only has to return an awaitable, create_task wants a coroutine
+        task = asyncio.ensure_future(app_call)
+        try:
+            done, _ = await asyncio.wait({task}, timeout=self.server.config.APP_TIMEOUT)
+        finally:
+            if not task.done():
+                task.cancel()
+        if not done:
+            await asyncio.gather(task, return_exceptions=True)
+            self.child_log.warning(
+                f"{http_handler.request.request_id} app didn't finish within "
+                f"{self.server.config.APP_TIMEOUT} seconds, cancelled it"
+            )
+            raise HTTPError(503)
+        task.result()
 
     async def websocket_loop(
-        self, client_socket: socket.socket, http_handler: HTTPHandler
+        self,
+        client_socket: socket.socket,
+        http_handler: HTTPHandler,
+        buffered: bytes = b"",
     ) -> None:
         websocket_handler = WebSocketHandler(self.server)
         websocket_handler.request = http_handler.request
         websocket_handler.response = http_handler.response
+        websocket_handler.client_info = http_handler.client_info
         websocket_handler.ws_shake_hand()
+        request_id = websocket_handler.request.request_id
         app = self.get_app(websocket_handler.request)
-        await app(
-            websocket_handler.create_scope(),
-            websocket_handler.receive,
-            websocket_handler.send,
-        )
-        if websocket_handler.state == WebSocketState.ACCEPTED:
-            await self.loop.sock_sendall(
-                client_socket, websocket_handler.response.to_http()
+        app_task = asyncio.ensure_future(
+            app(
+                websocket_handler.create_scope(),
+                websocket_handler.receive,
+                websocket_handler.send,
             )
-        else:
+        )
+        handshake = self.loop.create_task(websocket_handler.state_changed.wait())
+        await asyncio.wait({app_task, handshake}, return_when=asyncio.FIRST_COMPLETED)
+        handshake.cancel()
+        if not websocket_handler.accepted:
+            websocket_handler.disconnected(1006)
+            # raises whatever the app raised before accepting
+            await app_task
             raise HTTPError(403)
+        await sock_sendall(
+            self.loop,
+            client_socket,
+            websocket_handler.response.to_http(),
+            self.server.config.WRITE_TIMEOUT,
+        )
+        self.log_access(
+            websocket_handler.request,
+            websocket_handler.response,
+            websocket_handler.client_info,
+        )
         websocket_handler.response.clear()
-        self.log_access(websocket_handler.request, websocket_handler.response)
-        websocket = WebSocket()
-        websocket_handler.websocket = websocket
+        reader = self.loop.create_task(
+            self.websocket_reader(websocket_handler, client_socket, buffered)
+        )
+        writer = self.loop.create_task(
+            self.websocket_writer(websocket_handler, client_socket)
+        )
+        tasks = {app_task, reader, writer}
+        heartbeat = None
+        if self.server.config.WEBSOCKET_PING_INTERVAL:
+            heartbeat = self.loop.create_task(
+                self.websocket_heartbeat(websocket_handler)
+            )
+            tasks.add(heartbeat)
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        if heartbeat:
+            if heartbeat.done():
+                # the client stopped answering pings, it's not worth waiting on
+                self.child_log.debug(f"{request_id} Websocket ping timed out")
+                websocket_handler.disconnected(1006)
+                reader.cancel()
+                writer.cancel()
+            heartbeat.cancel()
+        if app_task.done():
+            # the app returned without closing
+            await websocket_handler.close(1011 if app_task.exception() else 1000)
+        if writer.done() and not writer.cancelled() and writer.exception():
+            self.child_log.debug(f"{request_id} {writer.exception()}")
+            reader.cancel()
+        # the close frame goes out before anything else, then the client gets a
+        # moment to answer it so the socket isn't reset with its reply unread
+        await asyncio.wait({writer})
+        if not reader.done():
+            await asyncio.wait(
+                {reader}, timeout=self.server.config.WEBSOCKET_CLOSE_TIMEOUT
+            )
+            reader.cancel()
+        self.server.broadcast.leave_all(websocket_handler)
+        await self.close_socket(client_socket, http_handler)
+        websocket_handler.disconnected(1006)
+        try:
+            await app_task
+        except ClientDisconnected:
+            pass
+        except Exception as err:
+            self.exception_log.exception(err, extra={"request_id": request_id})
+
+    async def websocket_reader(
+        self,
+        websocket_handler: WebSocketHandler,
+        client_socket: socket.socket,
+        buffered: bytes,
+    ) -> None:
+        websocket = websocket_handler.websocket
+        request_id = websocket_handler.request.request_id
+        try:
+            # frames the client sent straight after its upgrade request
+            websocket.feed(buffered)
+            while True:
+                frame = await self.get_websocket_frame(websocket, client_socket)
+                if frame.opcode == Opcodes.PING:
+                    for pong in websocket.write(frame.payload, pong=True):
+                        await websocket_handler.send_queue.put(pong)
+                elif frame.opcode == Opcodes.TERMINATE:
+                    code = frame.close_code
+                    await websocket_handler.close(1000 if code == 1005 else code)
+                    websocket.diconnect_code = code
+                    return
+                elif frame.opcode == Opcodes.PONG:
+                    websocket_handler.pong_received(frame.payload)
+                else:
+                    websocket.add_read_frame(frame)
+                    if frame.fin:
+                        message = websocket.read()
+                        websocket.clear_frames()
+                        await websocket_handler.push_message(message or b"")
+        except (ClientDisconnected, ConnectionError, socket.timeout) as err:
+            self.child_log.debug(f"{request_id} {err}")
+            # closed without a close frame, nothing more can be written
+            websocket_handler.disconnected(1006)
+            websocket_handler.send_queue.put_nowait(None)
+        except UnicodeDecodeError as err:
+            self.child_log.debug(f"{request_id} {err}")
+            await websocket_handler.close(1007)
+        except WebSocketError as err:
+            self.child_log.debug(f"{request_id} {err}")
+            await websocket_handler.close(
+                1009 if isinstance(err, MessageTooBig) else 1002
+            )
+
+    async def websocket_heartbeat(self, websocket_handler: WebSocketHandler) -> None:
+        """
+        Pings the client every WEBSOCKET_PING_INTERVAL seconds. Pongs are matched by
+        the reader as they arrive so messages never wait behind a ping, this only
+        returns when a pong doesn't come back within WEBSOCKET_PING_TIMEOUT. With a
+        timeout of 0 the pings keep the connection busy but nobody is dropped.
+        """
+        config = self.server.config
         while True:
-            websocket.clear_frames()
-            await self.websocket_read(websocket, client_socket)
-            if websocket.should_terminate:
-                await self.close_socket(client_socket, http_handler)
-                websocket_handler.state = WebSocketState.DISCONNECTED
-                await app(
-                    websocket_handler.create_scope(),
-                    websocket_handler.receive,
-                    websocket_handler.send,
-                )
-                break
-            if websocket.being_pinged:
-                await self.send_websocket_pong(websocket, client_socket)
+            await asyncio.sleep(config.WEBSOCKET_PING_INTERVAL)
+            pong = await websocket_handler.ping()
+            if not config.WEBSOCKET_PING_TIMEOUT:
                 continue
+            try:
+                await asyncio.wait_for(pong, config.WEBSOCKET_PING_TIMEOUT)
+            except asyncio.TimeoutError:
+                return
 
-            await self.send_websocket_ping(websocket, client_socket)
+    async def websocket_writer(
+        self, websocket_handler: WebSocketHandler, client_socket: socket.socket
+    ) -> None:
+        """
+        Everything queued by the time the socket is ready is written with a single
+        sendmsg, frame headers and payloads as they are without joining them.
+        """
+        send_queue = websocket_handler.send_queue
+        while True:
+            buffers: List[Union[bytes, memoryview]] = []
+            frame = await send_queue.get()
+            while frame is not None:
+                buffers += frame
+                if send_queue.empty():
+                    break
+                frame = send_queue.get_nowait()
+            await sock_sendmsg(
+                self.loop, client_socket, buffers, self.server.config.WRITE_TIMEOUT
+            )
+            if frame is None:
+                return
 
-    async def send_websocket_ping(
+    async def get_websocket_frame(
         self, websocket: WebSocket, client_socket: socket.socket
-    ) -> None:
-        if randint(0, 20):
-            websocket.clear_frames()
-            websocket.write("ping", ping=True)
-            response = websocket.pop_write_frame()
-            if response:
-                await self.loop.sock_sendall(client_socket, response)
-            frame = await self.get_websocket_frame(client_socket)
-            if not frame.is_pong and frame.message != "ping":
-                raise WebSocketError(
-                    "Client didn't respond properly after being pinged"
+    ) -> Frame:
+        frame = websocket.next_frame()
+        while frame is None:
+            try:
+                size = await asyncio.wait_for(
+                    self.recv_into(client_socket, websocket.feed),
+                    self.server.config.WEBSOCKET_IDLE_TIMEOUT or None,
                 )
+            except asyncio.TimeoutError:
+                raise ClientDisconnected("Websocket client was idle for too long")
+            if not size:
+                raise ClientDisconnected("Websocket client closed the connection")
+            frame = websocket.next_frame()
+        return frame
 
-    async def send_websocket_pong(
-        self, websocket: WebSocket, client_socket: socket.socket
-    ) -> None:
-        message = websocket.read()
-        websocket.write(message or "", pong=True)
-        response = websocket.pop_write_frame()
-        if response:
-            await self.loop.sock_sendall(client_socket, response)
+    async def recv_into(
+        self, client_socket: socket.socket, sink: Callable[[memoryview], Any]
+    ) -> int:
+        return await sock_recv_into(
+            self.loop, client_socket, self.server.buffer_pool, sink
+        )
 
-    async def websocket_read(
-        self, websocket: WebSocket, client_socket: socket.socket
+    async def send_buffers(
+        self, client_socket: socket.socket, buffers: Sequence[bytes]
     ) -> None:
-        while not websocket.reading_complete:
-            frame = await self.get_websocket_frame(client_socket)
-            websocket.add_read_frame(frame)
-
-    async def get_websocket_frame(self, client_socket: socket.socket) -> Frame:
-        with BytesIO() as request_data:
-            while True:
-                try:
-                    data = await self.loop.sock_recv(
-                        client_socket, self.server.config.RECV_BYTES
-                    )
-                    request_data.write(data)
-                except socket.timeout:
-                    pass
-                frame = Frame(request_data.getvalue())
-                if frame.is_complete:
-                    break
-            return frame
+        await sock_sendmsg(
+            self.loop, client_socket, buffers, self.server.config.WRITE_TIMEOUT
+        )
 
-    async def finish_response(
-        self, client_socket: socket.socket, http_handler: HTTPHandler
+    async def send_file(
+        self, client_socket: socket.socket, file: Any, offset: int, count: int
     ) -> None:
+        await sock_sendfile(
+            self.loop,
+            client_socket,
+            file,
+            offset,
+            count,
+            self.server.config.WRITE_TIMEOUT,
+        )
+
+    async def finish_response(self, http_handler: HTTPHandler) -> bool:
         try:
-            if http_handler.response:
-                http_handler.response.add_header(
-                    "x-request-id", http_handler.request.request_id
-                )
-                await self.loop.sock_sendall(
-                    client_socket, http_handler.response.to_http()
-                )
+            if not http_handler.response_started:
+                if not http_handler.response:
+                    self.child_log.error("App returned without sending a response")
+                    self.set_error_response(http_handler, 500, b"Internal Server Error")
+                await http_handler.write_body(http_handler.response.body.read(), False)
+            elif not http_handler.response_complete:
+                # the app stopped part way through the body
+                http_handler.keep_alive = False
+        except (ConnectionError, socket.timeout) as err:
+            self.child_log.debug(f"{http_handler.request.request_id} {err}")
+            http_handler.keep_alive = False
         except OSError as err:
             self.exception_log.exception(
                 err, extra={"request_id": http_handler.request.request_id}
             )
-        await self.close_socket(client_socket, http_handler)
+            http_handler.keep_alive = False
+        http_handler.closing = True
+        return http_handler.keep_alive
 
     async def close_socket(
         self, client_socket: socket.socket, http_handler: HTTPHandler
     ) -> None:
         http_handler.closing = True
-        try:
-            await self.send_to_app(http_handler)
-        except HTTPError:
-            pass
         client_socket.close()
 
     async def start(self) -> None:
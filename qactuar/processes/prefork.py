@@ -1,36 +1,125 @@
+import asyncio
+import os
+import socket
 import sys
-from multiprocessing.queues import Queue
-from queue import Empty
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional, Set
 
 from qactuar.processes.base import BaseProcessHandler
+from qactuar.util import recv_fd, wait_readable
 
 if TYPE_CHECKING:
     from qactuar.servers.prefork import PreForkServer
 
 
 class PreForkChild(BaseProcessHandler):
-    def __init__(self, server: "PreForkServer", queue: Queue):
+    def __init__(self, server: "PreForkServer", index: int):
         super().__init__(server)
-        self.server = server
-        self.queue = queue
+        self.server: "PreForkServer" = server
+        self.server.loop = self.loop
+        self.index = index
+        self.tasks: Set[asyncio.Task] = set()
 
     async def start(self) -> None:
+        self.server.broadcast.start(self.loop, self.index)
+        if self.server.reuse_port:
+            await self.accept_connections()
+        elif self.server.config.PREFORK_DISPATCH == "least_loaded":
+            await self.receive_connections()
+        else:
+            await self.wait_for_connections()
+
+    async def wait_for_connections(self) -> None:
+        wakeup = self.server.wakeups[self.index][0]
+        os.set_blocking(wakeup, False)
+        for listen_socket in self.server.listen_sockets:
+            listen_socket.setblocking(False)
         while True:
+            await wait_readable(self.loop, wakeup)
+            try:
+                tokens = os.read(wakeup, 4096)
+            except BlockingIOError:
+                continue
+            for _ in tokens:
+                try:
+                    client_socket = self.accept_any_connection()
+                except BlockingIOError:
+                    # another process got to the connection first
+                    break
+                if client_socket:
+                    self.spawn(client_socket)
+
+    def accept_any_connection(self) -> Optional[socket.socket]:
+        for listen_socket in self.server.listen_sockets:
             try:
-                ready = self.queue.get(timeout=0.001)
-            except Empty:
-                pass
-            else:
-                if ready:
-                    client_socket = await self.server.async_accept_client_connection()
-                    if client_socket:
-                        client_socket = self.setup_ssl(client_socket)
-                        await self.handle_request(client_socket)
-
-
-def make_child(server: "PreForkServer", queue: Queue) -> None:
-    child = PreForkChild(server, queue)
+                return self.server.accept_client_connection(listen_socket)
+            except BlockingIOError:
+                continue
+        raise BlockingIOError
+
+    async def accept_connections(self) -> None:
+        listen_sockets = []
+        for listen_socket in self.server.listen_sockets:
+            address = self.server.tcp_addresses.get(listen_socket)
+            if address:
+                # give this process its own socket in the SO_REUSEPORT group
+                listen_socket.close()
+                listen_socket = self.server.create_listen_socket(*address)
+            # unix and inherited sockets can't be reopened so they are shared
+            listen_socket.setblocking(False)
+            listen_sockets.append(listen_socket)
+        self.server.listen_sockets = listen_sockets
+        await asyncio.gather(
+            *[
+                self.accept_from(listen_socket)
+                for listen_socket in self.server.listen_sockets
+            ]
+        )
+
+    async def accept_from(self, listen_socket: socket.socket) -> None:
+        while True:
+            client_socket = await self.server.async_accept_client_connection(
+                listen_socket
+            )
+            if client_socket:
+                self.spawn(client_socket)
+
+    async def receive_connections(self) -> None:
+        channel = self.server.channels[self.index][1]
+        channel.setblocking(False)
+        while True:
+            await wait_readable(self.loop, channel)
+            while True:
+                try:
+                    fd = recv_fd(channel)
+                except BlockingIOError:
+                    break
+                if fd is not None:
+                    task = self.spawn(socket.socket(fileno=fd))
+                    task.add_done_callback(self.release_load)
+
+    def spawn(self, client_socket: socket.socket) -> asyncio.Task:
+        client_socket.setblocking(False)
+        task = self.loop.create_task(self.handle_connection(client_socket))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def release_load(self, _: asyncio.Task) -> None:
+        with self.server.loads.get_lock():
+            self.server.loads[self.index] -= 1
+
+    async def handle_connection(self, client_socket: socket.socket) -> None:
+        try:
+            connection = await self.setup_ssl(client_socket)
+            if connection:
+                await self.handle_request(connection)
+        except Exception as err:
+            self.exception_log.exception(err)
+            client_socket.close()
+
+
+def make_child(server: "PreForkServer", index: int) -> None:
+    child = PreForkChild(server, index)
     try:
         child.loop.run_until_complete(child.start())
     except KeyboardInterrupt:
@@ -14,8 +14,9 @@ class ChildProcess(BaseProcessHandler):
     async def start(self, client_socket: socket.socket = None) -> None:
         if not client_socket:
             return
-        client_socket = self.setup_ssl(client_socket)
-        await self.handle_request(client_socket)
+        connection = await self.setup_ssl(client_socket)
+        if connection:
+            await self.handle_request(connection)
 
 
 def make_child(server: "SimpleForkServer", client_socket: socket.socket) -> None:
@@ -4,7 +4,6 @@ from uuid import uuid4
 
 from qactuar.header import Header
 from qactuar.models import Headers
-from qactuar.util import BytesList
 
 
 class Request:
@@ -15,6 +14,7 @@ class Request:
         self._path: str = ""
         self._original_path: str = ""
         self._raw_path: bytes = b""
+        self._root_path: str = ""
         self._query_string: bytes = b""
         self._headers: Headers = []
         self._parsed_headers: Header = Header()
@@ -25,13 +25,19 @@ class Request:
             self.parse()
 
     def parse(self) -> None:
-        lines = self._raw_request.split(b"\r\n")
+        head, separator, body = self._raw_request.partition(b"\r\n\r\n")
+        self.parse_head(head)
+        self.headers_complete = bool(separator)
+        self._body = body
+
+    def parse_head(self, head: bytes) -> None:
+        lines = head.split(b"\r\n")
 
         method, path, request_version = lines.pop(0).split(b" ")
         self._method = method.decode("utf-8")
         self._request_version = request_version.decode("utf-8")
 
-        path_parts = path.split(b"?")
+        path_parts = path.split(b"?", 1)
         self._path = urllib.parse.unquote(path_parts[0].decode("utf-8"))
         self._original_path = self._path
         self._raw_path = path_parts[0]
@@ -41,19 +47,12 @@ class Request:
             query_string = b""
         self._query_string = query_string
 
-        line_num = 0
+        self._headers = []
         for line in lines:
-            if not line:
-                self.headers_complete = True
-                break
-            line_num += 1
-            key, value = line.split(b": ", 1)
-            self._headers.append((key.lower(), value))
+            key, value = line.split(b":", 1)
+            self._headers.append((key.strip().lower(), value.strip()))
         self._parsed_headers = Header(self._headers)
-
-        body = BytesList()
-        body.writelines(lines[line_num:])
-        self._body = body.read()
+        self.headers_complete = True
 
     @property
     def headers(self) -> Header:
@@ -91,6 +90,14 @@ class Request:
     def raw_path(self) -> bytes:
         return self._raw_path
 
+    @property
+    def root_path(self) -> str:
+        return self._root_path
+
+    @root_path.setter
+    def root_path(self, root_path: str) -> None:
+        self._root_path = root_path
+
     @property
     def query_string(self) -> bytes:
         return self._query_string
@@ -99,6 +106,10 @@ class Request:
     def body(self) -> bytes:
         return self._body
 
+    @body.setter
+    def body(self, body: bytes) -> None:
+        self._body = body
+
     @property
     def raw_request(self) -> bytes:
         return self._raw_request
@@ -117,6 +128,7 @@ class Request:
         self._path = ""
         self._original_path = ""
         self._raw_path = b""
+        self._root_path = ""
         self._query_string = b""
         self._headers = []
         self._parsed_headers = Header()
@@ -1,35 +1,68 @@
 from dataclasses import dataclass, field
-from datetime import datetime
 from email.utils import formatdate
-from time import mktime
-from typing import Union
+from http import HTTPStatus
+from time import time
+from typing import Dict, List, Optional, Union
 
 from qactuar import __version__
+from qactuar.header import Header
 from qactuar.models import Headers
 from qactuar.request import Request
-from qactuar.util import BytesList
+from qactuar.util import ByteBuffer
+
+SERVER_HEADER = b"Server: Qactuar " + __version__.encode("utf-8") + b"\r\n"
+STATUS_LINES: Dict[bytes, bytes] = {
+    str(status.value).encode("utf-8"): (
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n".encode("utf-8")
+    )
+    for status in HTTPStatus
+}
+
+
+class DateHeader:
+    """
+    The Date header only changes once a second so it is formatted once per second and
+    reused for every response sent in between.
+    """
+
+    def __init__(self) -> None:
+        self._second = 0
+        self._header = b""
+
+    def get(self) -> bytes:
+        now = int(time())
+        if now != self._second:
+            self._second = now
+            self._header = b"Date: " + formatdate(now, usegmt=True).encode() + b"\r\n"
+        return self._header
+
+
+DATE_HEADER = DateHeader()
+
+
+def status_line(status: bytes) -> bytes:
+    line = STATUS_LINES.get(status)
+    if line is None:
+        line = b"HTTP/1.1 " + status + b"\r\n"
+    return line
 
 
 @dataclass
 class Response:
     status: bytes = b"200"
     headers: Headers = field(default_factory=list)
-    body: BytesList = field(default_factory=BytesList)
+    body: ByteBuffer = field(default_factory=ByteBuffer)
     request: Request = field(default_factory=Request)
 
+    def head(self) -> bytes:
+        head: List[bytes] = [status_line(self.status), DATE_HEADER.get(), SERVER_HEADER]
+        for key, value in self.headers:
+            head += [key, b": ", value, b"\r\n"]
+        head.append(b"\r\n")
+        return b"".join(head)
+
     def to_http(self) -> bytes:
-        headers = [
-            (b"Date", formatdate(mktime(datetime.now().timetuple())).encode("utf-8")),
-            (b"Server", b"Qactuar " + __version__.encode("utf-8")),
-        ] + self.headers
-        response = BytesList()
-        response.writelines(b"HTTP/1.1 ", self.status, b"\r\n")
-        for header in headers:
-            key, value = header
-            response.writelines(key, b": ", value, b"\r\n")
-        response.write(b"\r\n")
-        response.writelines(self.body.readlines())
-        return response.read()
+        return b"".join((self.head(), self.body.view()))
 
     def clear(self) -> None:
         self.status = b"200"
@@ -39,6 +72,15 @@ class Response:
     def __bool__(self) -> bool:
         return bool(self.headers) or bool(self.body)
 
+    def get_header(self, name: bytes) -> Optional[bytes]:
+        return Header(self.headers).get_raw(name)
+
+    def has_body(self, method: str) -> bool:
+        if method == "HEAD":
+            return False
+        status = self.status[:3]
+        return not status.startswith(b"1") and status not in (b"204", b"304")
+
     def add_header(self, name: Union[str, bytes], value: Union[str, bytes]) -> None:
         if isinstance(name, str):
             header_name = name.encode("utf-8")
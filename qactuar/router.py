@@ -0,0 +1,63 @@
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from qactuar.models import ASGIApp
+
+Match = Tuple[ASGIApp, str]
+
+
+def _split(path: str) -> List[str]:
+    return [segment for segment in path.split("/") if segment]
+
+
+class RouteNode:
+    __slots__ = ("children", "app", "root_path")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "RouteNode"] = {}
+        self.app: Optional[ASGIApp] = None
+        self.root_path: str = ""
+
+
+class Router:
+    """
+    Finds the app mounted at the longest route that is a prefix of a request path.
+    Routes are stored in a trie keyed by path segment so that a lookup only walks as
+    many nodes as the path has segments no matter how many apps are mounted, and a
+    route only matches on a segment boundary ("/api" matches "/api/users" but not
+    "/apiary"). Recent lookups are cached since most traffic hits a handful of paths.
+    """
+
+    def __init__(self, cache_size: int = 1024) -> None:
+        self.root = RouteNode()
+        self._match = lru_cache(maxsize=cache_size)(self._find)
+
+    def add(self, route: str, app: ASGIApp) -> None:
+        node = self.root
+        segments = _split(route)
+        for segment in segments:
+            node = node.children.setdefault(segment, RouteNode())
+        node.app = app
+        node.root_path = "".join(f"/{segment}" for segment in segments)
+        self._match.cache_clear()
+
+    def match(self, path: str) -> Optional[Match]:
+        """
+        Returns the app and the root_path it is mounted at, or None if no route
+        matches.
+        """
+        return self._match(path)
+
+    def _find(self, path: str) -> Optional[Match]:
+        node = self.root
+        found = node
+        for segment in _split(path):
+            child = node.children.get(segment)
+            if child is None:
+                break
+            node = child
+            if node.app is not None:
+                found = node
+        if found.app is None:
+            return None
+        return found.app, found.root_path
@@ -1,4 +1,6 @@
-import select
+import asyncio
+import socket
+from typing import Set
 
 from qactuar import ASGIApp, Config
 from qactuar.processes.async_only import make_child
@@ -14,26 +16,36 @@ class AsyncOnlyServer(BaseQactuarServer):
         config: Config = None,
     ):
         super().__init__(host, port, app, config)
+        self.tasks: Set[asyncio.Task] = set()
 
     def serve_forever(self) -> None:
         self.start_up()
-        self.loop.run_until_complete(self._serve_forever())
+        try:
+            self.loop.run_until_complete(self._serve_forever())
+        except KeyboardInterrupt:
+            # raised from the selector, outside of any task
+            self.loop.run_until_complete(self.async_shut_down())
 
     async def _serve_forever(self) -> None:
+        for listen_socket in self.listen_sockets:
+            listen_socket.setblocking(False)
         try:
-            while True:
-                await self.select_socket()
+            await asyncio.gather(
+                *[
+                    self.accept_connections(listen_socket)
+                    for listen_socket in self.listen_sockets
+                ]
+            )
         except KeyboardInterrupt:
             await self.async_shut_down()
         except Exception as err:
             self.exception_log.exception(err)
             await self.async_shut_down()
 
-    async def select_socket(self) -> None:
-        ready_to_read, _, _ = select.select(
-            [self.listen_socket], [], [], self.config.SELECT_SLEEP_TIME
-        )
-        if ready_to_read:
-            client_socket = await self.async_accept_client_connection()
+    async def accept_connections(self, listen_socket: socket.socket) -> None:
+        while True:
+            client_socket = await self.async_accept_client_connection(listen_socket)
             if client_socket:
-                await make_child(self, client_socket)
+                task = self.loop.create_task(make_child(self, client_socket))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
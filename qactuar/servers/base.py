@@ -4,16 +4,20 @@ import multiprocessing
 import os
 import socket
 import ssl
+import stat
 import sys
 from importlib import import_module
 from logging import Logger, getLogger, setLoggerClass
 from logging.config import dictConfig
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
+from qactuar.broadcast import Broadcast
 from qactuar.config import Config, config_init
 from qactuar.handlers import LifespanHandler
 from qactuar.logs import QactuarLogger
 from qactuar.models import ASGIApp, Receive, Scope, Send
+from qactuar.router import Router
+from qactuar.util import BufferPool, listen_fds
 
 
 class BaseQactuarServer(object):
@@ -21,7 +25,6 @@ class BaseQactuarServer(object):
     socket_type = socket.SOCK_STREAM
     socket_level = socket.SOL_SOCKET
     socket_opt_name = socket.SO_REUSEADDR
-    request_queue_size = 65536
 
     def __init__(
         self,
@@ -49,14 +52,12 @@ class BaseQactuarServer(object):
         self.port: int = port or self.config.PORT
         self.scheme: str = "http"
 
-        self.listen_socket: socket.socket = socket.socket(
-            self.address_family, self.socket_type
-        )
-        self.listen_socket.setsockopt(self.socket_level, self.socket_opt_name, 1)
-        self.listen_socket.bind((self.host, self.port))
-        self.listen_socket.listen(self.request_queue_size)
-
         self.ssl_context: Optional[ssl.SSLContext] = None
+        # TCP listeners this server bound itself, with the address they're bound to
+        self.tcp_addresses: Dict[socket.socket, Tuple[str, int]] = {}
+        self.unix_paths: List[str] = []
+        self.listen_sockets: List[socket.socket] = self.create_listen_sockets()
+
         if self.config.SSL_CERT_PATH and self.config.SSL_KEY_PATH:
             self.setup_ssl()
 
@@ -67,18 +68,145 @@ class BaseQactuarServer(object):
         self.loop = asyncio.get_event_loop()
         self.processes: Dict[int, multiprocessing.Process] = {}
         self.shutting_down: bool = False
+        # after forking every worker has its own copy of the pool
+        self.buffer_pool: BufferPool = BufferPool(
+            self.config.RECV_BYTES, self.config.RECV_BUFFER_POOL_SIZE
+        )
         self.lifespan_handler: LifespanHandler = LifespanHandler(self)
-        self.apps: Dict[str, ASGIApp] = {"/": app} if app else {}
+        self.broadcast: Broadcast = Broadcast(self.config)
+        self.apps: Dict[str, ASGIApp] = {}
+        self.router: Router = Router()
+        if app:
+            self.add_app(app)
         for route, app_path in self.config.APPS.items():
             module_str, app_str = app_path.split(":")
             app_module = import_module(module_str)
-            self.apps[route] = getattr(app_module, app_str)
+            self.add_app(getattr(app_module, app_str), route)
 
     def serve_forever(self) -> None:
         raise NotImplementedError
 
+    @property
+    def reuse_port(self) -> bool:
+        return False
+
+    def create_listen_sockets(self) -> List[socket.socket]:
+        """
+        Sockets handed over by systemd socket activation come first, then one for
+        each BIND address. Only when there are neither is HOST:PORT bound.
+        """
+        listen_sockets = [socket.socket(fileno=fd) for fd in listen_fds()]
+        for address in self.config.BIND:
+            listen_sockets.append(self.bind(address))
+        if not listen_sockets:
+            listen_sockets.append(self.bind(f"{self.host}:{self.port}"))
+        return listen_sockets
+
+    def bind(self, address: str) -> socket.socket:
+        """
+        Takes "unix:/path/to.sock" for a Unix domain socket, "fd://3" for an already
+        listening socket inherited from the parent process or "host:port" for TCP,
+        IPv6 hosts go in square brackets.
+        """
+        if address.startswith("unix:"):
+            return self.create_unix_socket(address[5:])
+        if address.startswith("fd://"):
+            return socket.socket(fileno=int(address[5:]))
+        host, _, port = address.rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError(f"bind address not recognised: {address}")
+        host = host.strip("[]")
+        listen_socket = self.create_listen_socket(host, int(port))
+        self.tcp_addresses[listen_socket] = (host, int(port))
+        return listen_socket
+
+    def create_listen_socket(self, host: str = None, port: int = None) -> socket.socket:
+        host = host or self.host
+        port = port or self.port
+        address_family = socket.AF_INET6 if ":" in host else self.address_family
+        listen_socket = socket.socket(address_family, self.socket_type)
+        listen_socket.setsockopt(self.socket_level, self.socket_opt_name, 1)
+        if self.reuse_port:
+            if not hasattr(socket, "SO_REUSEPORT"):
+                raise ValueError("SO_REUSEPORT is not supported on this platform")
+            listen_socket.setsockopt(self.socket_level, socket.SO_REUSEPORT, 1)
+        self.set_buffer_sizes(listen_socket)
+        listen_socket.bind((host, port))
+        self.set_listen_options(listen_socket)
+        listen_socket.listen(self.config.BACKLOG)
+        return listen_socket
+
+    def create_unix_socket(self, path: str) -> socket.socket:
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError("Unix domain sockets are not supported on this platform")
+        try:
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                # left behind by a server that didn't shut down cleanly
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+        listen_socket = socket.socket(socket.AF_UNIX, self.socket_type)
+        self.set_buffer_sizes(listen_socket)
+        listen_socket.bind(path)
+        listen_socket.listen(self.config.BACKLOG)
+        self.unix_paths.append(path)
+        return listen_socket
+
+    def set_buffer_sizes(self, sock: socket.socket) -> None:
+        # accepted sockets inherit these from the listener, setting them before
+        # bind/listen lets the TCP window scale be negotiated for the larger size
+        if self.config.SO_SNDBUF:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.config.SO_SNDBUF)
+        if self.config.SO_RCVBUF:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.config.SO_RCVBUF)
+
+    def set_listen_options(self, listen_socket: socket.socket) -> None:
+        """
+        TCP_DEFER_ACCEPT only wakes the server for a connection once the client has
+        sent something and TCP_FASTOPEN lets a returning client send its request in
+        the SYN. Both are skipped where the platform doesn't have them.
+        """
+        if self.config.TCP_DEFER_ACCEPT and hasattr(socket, "TCP_DEFER_ACCEPT"):
+            listen_socket.setsockopt(
+                socket.IPPROTO_TCP,
+                socket.TCP_DEFER_ACCEPT,
+                self.config.TCP_DEFER_ACCEPT,
+            )
+        if self.config.TCP_FASTOPEN and hasattr(socket, "TCP_FASTOPEN"):
+            listen_socket.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_FASTOPEN, self.config.TCP_FASTOPEN
+            )
+
+    def set_client_options(self, client_socket: socket.socket) -> None:
+        if client_socket.family not in (socket.AF_INET, socket.AF_INET6):
+            return
+        if self.config.TCP_NODELAY:
+            # responses are written in as few sends as possible already, Nagle's
+            # algorithm would only hold back the last small segment of each one
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.config.TCP_QUICKACK and hasattr(socket, "TCP_QUICKACK"):
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+    @staticmethod
+    def describe_socket(listen_socket: socket.socket) -> str:
+        address = listen_socket.getsockname()
+        if isinstance(address, tuple):
+            host, port = address[:2]
+            return f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+        return f"unix:{address}"
+
+    def close_listen_sockets(self) -> None:
+        for listen_socket in self.listen_sockets:
+            listen_socket.close()
+        for path in self.unix_paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
     def add_app(self, application: ASGIApp, route: str = "/") -> None:
         self.apps[route] = application
+        self.router.add(route, application)
 
     def start_up(self) -> None:
         self.send_to_all_apps(
@@ -86,13 +214,16 @@ class BaseQactuarServer(object):
             self.lifespan_handler.receive,
             self.lifespan_handler.send,
         )
-        self.server_log.info(
-            f"Qactuar: Serving {self.scheme.upper()} on {self.host}:{self.port}"
-        )
+        for listen_socket in self.listen_sockets:
+            self.server_log.info(
+                f"Qactuar: Serving {self.scheme.upper()} on "
+                f"{self.describe_socket(listen_socket)}"
+            )
 
     def shut_down(self) -> None:
         self.shutting_down = True
         self.server_log.info("Shutting Down")
+        self.close_listen_sockets()
         self.send_to_all_apps(
             self.lifespan_handler.create_scope(),
             self.lifespan_handler.receive,
@@ -103,6 +234,7 @@ class BaseQactuarServer(object):
     async def async_shut_down(self) -> None:
         self.shutting_down = True
         self.server_log.info("Shutting Down")
+        self.close_listen_sockets()
         await self.async_send_to_all_apps(
             self.lifespan_handler.create_scope(),
             self.lifespan_handler.receive,
@@ -115,11 +247,23 @@ class BaseQactuarServer(object):
         context.load_cert_chain(self.config.SSL_CERT_PATH, self.config.SSL_KEY_PATH)
         context.options |= ssl.PROTOCOL_TLS
         context.set_ciphers(self.config.SSL_CIPHERS)
+        # the ticket keys are generated with the context, it has to be made before
+        # forking for tickets to be accepted by every process
+        if self.config.SSL_SESSION_TICKETS:
+            context.options &= ~ssl.OP_NO_TICKET
+            context.num_tickets = self.config.SSL_SESSION_TICKETS
+        else:
+            context.options |= ssl.OP_NO_TICKET
+            context.num_tickets = 0
+        alpn_protocols = [
+            protocol.strip()
+            for protocol in self.config.SSL_ALPN_PROTOCOLS.split(",")
+            if protocol.strip()
+        ]
+        if alpn_protocols and ssl.HAS_ALPN:
+            context.set_alpn_protocols(alpn_protocols)
         self.ssl_context = context
         self.scheme = "https"
-        self.listen_socket = context.wrap_socket(
-            self.listen_socket, server_side=True, do_handshake_on_connect=False
-        )
 
     def send_to_all_apps(self, scope: Scope, receive: Receive, send: Send) -> None:
         for app in self.apps.values():
@@ -131,24 +275,28 @@ class BaseQactuarServer(object):
         for app in self.apps.values():
             await app(scope, receive, send)
 
-    def accept_client_connection(self) -> Optional[socket.socket]:
+    def accept_client_connection(
+        self, listen_socket: socket.socket
+    ) -> Optional[socket.socket]:
         try:
-            client_socket, self.client_info = self.listen_socket.accept()
+            client_socket, self.client_info = listen_socket.accept()
         except IOError as err:
             if err.args[0] != errno.EINTR:
                 raise
             return None
         else:
+            self.set_client_options(client_socket)
             return client_socket
 
-    async def async_accept_client_connection(self) -> Optional[socket.socket]:
+    async def async_accept_client_connection(
+        self, listen_socket: socket.socket
+    ) -> Optional[socket.socket]:
         try:
-            client_socket, self.client_info = await self.loop.sock_accept(
-                self.listen_socket
-            )
+            client_socket, self.client_info = await self.loop.sock_accept(listen_socket)
         except IOError as err:
             if err.args[0] != errno.EINTR:
                 raise
             return None
         else:
+            self.set_client_options(client_socket)
             return client_socket
@@ -1,10 +1,16 @@
 import multiprocessing
+import os
 import select
-from typing import Dict
+import socket
+from multiprocessing.connection import wait
+from typing import Dict, List, Tuple, Union
 
 from qactuar import ASGIApp, Config
 from qactuar.processes.prefork import make_child
 from qactuar.servers.base import BaseQactuarServer
+from qactuar.util import send_fd
+
+DISPATCH_TYPES = ("round_robin", "reuseport", "least_loaded")
 
 
 class PreForkServer(BaseQactuarServer):
@@ -16,34 +22,128 @@ class PreForkServer(BaseQactuarServer):
         config: Config = None,
     ):
         super().__init__(host, port, app, config)
-        self.queues: Dict[int, multiprocessing.Queue] = {}
+        if self.config.PREFORK_DISPATCH not in DISPATCH_TYPES:
+            raise ValueError(
+                f"prefork_dispatch parameter not recognised: "
+                f"{self.config.PREFORK_DISPATCH}"
+            )
+        if self.config.PREFORK_DISPATCH == "least_loaded" and not self.is_posix:
+            raise ValueError("least_loaded dispatch requires a POSIX platform")
+        self.wakeups: Dict[int, Tuple[int, int]] = {}
+        self.channels: Dict[int, Tuple[socket.socket, socket.socket]] = {}
         self.current_process = 0
+        # in-flight connection count per process, shared with the children
+        self.loads = multiprocessing.Array("i", self.config.PROCESS_POOL_SIZE or 1)
+
+    @property
+    def reuse_port(self) -> bool:
+        return self.config.PREFORK_DISPATCH == "reuseport"
 
     def serve_forever(self) -> None:
         self.start_up()
+        self.broadcast.create_bus(self.config.PROCESS_POOL_SIZE or 1)
         for i in range(self.config.PROCESS_POOL_SIZE or 1):
-            self.queues[i] = multiprocessing.Queue()
-            self.processes[i] = multiprocessing.Process(
-                target=make_child, args=(self, self.queues[i])
-            )
-            self.processes[i].daemon = True
-            self.processes[i].start()
+            self.start_process(i)
+        if self.reuse_port:
+            # every child has its own listeners now, leaving these in the
+            # SO_REUSEPORT group would strand the connections the kernel gives them
+            for listen_socket in self.tcp_addresses:
+                listen_socket.close()
         try:
             while True:
-                self.select_socket()
+                if self.reuse_port:
+                    self.watch_processes()
+                else:
+                    self.select_socket()
         except KeyboardInterrupt:
             self.shut_down()
         except Exception as err:
             self.exception_log.exception(err)
             self.shut_down()
 
+    def start_process(self, index: int) -> None:
+        if self.config.PREFORK_DISPATCH == "least_loaded":
+            if index in self.channels:
+                self.channels[index][0].close()
+            self.channels[index] = socket.socketpair(socket.AF_UNIX)
+            with self.loads.get_lock():
+                # whatever the last process in this place had open died with it
+                self.loads[index] = 0
+        elif not self.reuse_port:
+            if index in self.wakeups:
+                os.close(self.wakeups[index][1])
+            self.wakeups[index] = os.pipe()
+        self.processes[index] = multiprocessing.Process(
+            target=make_child, args=(self, index)
+        )
+        self.processes[index].daemon = True
+        self.processes[index].start()
+        # only the child keeps its end, so writing to it fails once the child is gone
+        if index in self.channels:
+            self.channels[index][1].close()
+        if index in self.wakeups:
+            os.close(self.wakeups[index][0])
+
+    def watch_processes(self) -> None:
+        wait([process.sentinel for process in self.processes.values()])
+        self.restart_processes()
+
+    def restart_processes(self) -> None:
+        for index, process in list(self.processes.items()):
+            if not process.is_alive():
+                self.server_log.warning(
+                    f"Process {process.ident} exited with code {process.exitcode}, "
+                    f"restarting"
+                )
+                process.close()
+                self.start_process(index)
+
     def select_socket(self) -> None:
+        # a process's sentinel becomes readable when it exits
+        readable: List[Union[socket.socket, int]] = [*self.listen_sockets]
+        readable += [process.sentinel for process in self.processes.values()]
         ready_to_read, _, _ = select.select(
-            [self.listen_socket], [], [], self.config.SELECT_SLEEP_TIME
+            readable, [], [], self.config.SELECT_SLEEP_TIME
         )
-        if ready_to_read:
-            self.queues[self.current_process].put_nowait(True)
-            self.next_process()
+        for ready in ready_to_read:
+            if isinstance(ready, int):
+                self.restart_processes()
+            elif self.config.PREFORK_DISPATCH == "least_loaded":
+                self.dispatch_connection(ready)
+            else:
+                self.wake_process()
+
+    def dispatch_connection(self, listen_socket: socket.socket) -> None:
+        client_socket = self.accept_client_connection(listen_socket)
+        if not client_socket:
+            return
+        try:
+            for index in self.processes_by_load():
+                with self.loads.get_lock():
+                    self.loads[index] += 1
+                try:
+                    send_fd(self.channels[index][0], client_socket.fileno())
+                    return
+                except OSError as err:
+                    # the process has died and is restarted once its sentinel is seen
+                    self.server_log.warning(
+                        f"Could not pass a connection to process {index}: {err}"
+                    )
+                    with self.loads.get_lock():
+                        self.loads[index] -= 1
+            self.server_log.error("No process could take the connection")
+        finally:
+            client_socket.close()
+
+    def wake_process(self) -> None:
+        try:
+            os.write(self.wakeups[self.current_process][1], b"\x01")
+        except OSError as err:
+            self.exception_log.exception(err)
+        self.next_process()
+
+    def processes_by_load(self) -> List[int]:
+        return sorted(self.processes, key=lambda index: self.loads[index])
 
     def next_process(self) -> None:
         if self.current_process >= len(self.processes) - 1:
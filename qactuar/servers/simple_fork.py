@@ -33,10 +33,10 @@ class SimpleForkServer(BaseQactuarServer):
 
     def select_socket(self) -> None:
         ready_to_read, _, _ = select.select(
-            [self.listen_socket], [], [], self.config.SELECT_SLEEP_TIME
+            self.listen_sockets, [], [], self.config.SELECT_SLEEP_TIME
         )
-        if ready_to_read:
-            accepted_socket = self.accept_client_connection()
+        for listen_socket in ready_to_read:
+            accepted_socket = self.accept_client_connection(listen_socket)
             if accepted_socket:
                 self.fork(accepted_socket)
 
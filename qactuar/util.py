@@ -1,10 +1,20 @@
+import array
 import asyncio
-from collections import Iterable as CollectionsInterable
+import errno
+import io
+import os
+import socket
+import ssl
 from logging import Logger, getLogger
-from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
 
 from qactuar.models import Headers, Message, Receive, Scope, Send
 
+try:
+    IOV_MAX = max(os.sysconf("SC_IOV_MAX"), 16)
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
 try:
     import uvloop
 
@@ -29,36 +39,339 @@ except ImportError:
         return asyncio.new_event_loop()
 
 
-class BytesList:
-    def __init__(self) -> None:
-        self._bytes_list: List[bytes] = []
+def _set_ready(ready: asyncio.Future) -> None:
+    if not ready.done():
+        ready.set_result(None)
+
+
+def _set_timed_out(ready: asyncio.Future) -> None:
+    if not ready.done():
+        ready.set_exception(socket.timeout("timed out"))
+
+
+async def wait_readable(
+    loop: asyncio.AbstractEventLoop,
+    fileobj: Union[int, socket.socket],
+    timeout: float = None,
+) -> None:
+    """
+    Waits for fileobj to be readable, raising socket.timeout if that takes longer
+    than timeout seconds.
+    """
+    ready = loop.create_future()
+    loop.add_reader(fileobj, _set_ready, ready)
+    timer = loop.call_later(timeout, _set_timed_out, ready) if timeout else None
+    try:
+        await ready
+    finally:
+        loop.remove_reader(fileobj)
+        if timer:
+            timer.cancel()
+
+
+async def wait_writable(
+    loop: asyncio.AbstractEventLoop,
+    fileobj: Union[int, socket.socket],
+    timeout: float = None,
+) -> None:
+    """
+    Waits for fileobj to be writable, raising socket.timeout if that takes longer
+    than timeout seconds.
+    """
+    ready = loop.create_future()
+    loop.add_writer(fileobj, _set_ready, ready)
+    timer = loop.call_later(timeout, _set_timed_out, ready) if timeout else None
+    try:
+        await ready
+    finally:
+        loop.remove_writer(fileobj)
+        if timer:
+            timer.cancel()
+
+
+async def ssl_call(
+    loop: asyncio.AbstractEventLoop,
+    sock: ssl.SSLSocket,
+    func: Callable[..., Any],
+    *args: Any,
+    timeout: float = None,
+) -> Any:
+    """
+    Calls a method of a non-blocking SSLSocket, waiting on the event loop whenever
+    OpenSSL needs the socket to be readable or writable first. A read can need a
+    write and the other way around (renegotiation, session tickets) so both are
+    handled for every call. If timeout is given then waiting longer than that for
+    the socket raises socket.timeout.
+    """
+    while True:
+        try:
+            return func(*args)
+        except ssl.SSLWantReadError:
+            await wait_readable(loop, sock, timeout)
+        except ssl.SSLWantWriteError:
+            await wait_writable(loop, sock, timeout)
+
+
+async def sock_sendall(
+    loop: asyncio.AbstractEventLoop,
+    sock: socket.socket,
+    data: bytes,
+    timeout: float = None,
+) -> None:
+    """
+    Writes all of data to a non-blocking socket. The timeout is how long to wait for
+    the client to make room for more before giving up with socket.timeout, not a
+    limit on the whole write.
+    """
+    view = memoryview(data)
+    while view:
+        if isinstance(sock, ssl.SSLSocket):
+            sent = await ssl_call(loop, sock, sock.send, view, timeout=timeout)
+        else:
+            try:
+                sent = sock.send(view)
+            except (BlockingIOError, InterruptedError):
+                await wait_writable(loop, sock, timeout)
+                continue
+        view = view[sent:]
+
+
+async def sock_sendmsg(
+    loop: asyncio.AbstractEventLoop,
+    sock: socket.socket,
+    buffers: Sequence[Union[bytes, memoryview]],
+    timeout: float = None,
+) -> None:
+    """
+    Writes all of the buffers to the socket with as few sendmsg (writev) calls as
+    possible so that a response head and its body never have to be joined into one
+    new bytes object first. Falls back to sock_sendall where sendmsg isn't available
+    such as on Windows or with SSL sockets.
+    """
+    if not hasattr(sock, "sendmsg") or isinstance(sock, ssl.SSLSocket):
+        await sock_sendall(loop, sock, b"".join(buffers), timeout)
+        return
+    views = [memoryview(buffer) for buffer in buffers if buffer]
+    index = 0
+    while index < len(views):
+        try:
+            sent = sock.sendmsg(views[index : index + IOV_MAX])
+        except (BlockingIOError, InterruptedError):
+            await wait_writable(loop, sock, timeout)
+            continue
+        while sent:
+            length = len(views[index])
+            if sent >= length:
+                sent -= length
+                index += 1
+            else:
+                views[index] = views[index][sent:]
+                sent = 0
+
+
+async def sock_sendfile(
+    loop: asyncio.AbstractEventLoop,
+    sock: socket.socket,
+    file: Any,
+    offset: int,
+    count: int,
+    timeout: float = None,
+) -> None:
+    """
+    Sends count bytes of the file from offset with os.sendfile so that the contents
+    never have to be copied into Python. Falls back to reading the file in chunks
+    for SSL sockets, which have to encrypt it in user space anyway, and where
+    sendfile isn't available or doesn't work for the file.
+    """
+    if not isinstance(sock, ssl.SSLSocket) and hasattr(os, "sendfile"):
+        try:
+            fileno = file.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            fileno = -1
+        while fileno != -1 and count:
+            try:
+                sent = os.sendfile(sock.fileno(), fileno, offset, count)
+            except (BlockingIOError, InterruptedError):
+                await wait_writable(loop, sock, timeout)
+                continue
+            except OSError as err:
+                if err.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK):
+                    raise
+                break
+            if not sent:
+                # the file is shorter than count
+                return
+            offset += sent
+            count -= sent
+    file.seek(offset)
+    while count:
+        data = file.read(min(count, 65536))
+        if not data:
+            break
+        await sock_sendall(loop, sock, data, timeout)
+        count -= len(data)
+
+
+def listen_fds() -> List[int]:
+    """
+    The file descriptors of listening sockets passed in by systemd socket activation
+    (sd_listen_fds). The environment variables are removed after reading them so
+    that processes started later don't try to use the same sockets.
+    """
+    if os.environ.get("LISTEN_PID") != str(os.getpid()):
+        return []
+    try:
+        count = int(os.environ.get("LISTEN_FDS", "0"))
+    except ValueError:
+        count = 0
+    for name in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+        os.environ.pop(name, None)
+    # the first passed descriptor is always 3 (SD_LISTEN_FDS_START)
+    return list(range(3, 3 + count))
+
+
+def send_fd(sock: socket.socket, fd: int) -> None:
+    fds = array.array("i", [fd])
+    sock.sendmsg([b"\x00"], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+
+
+def recv_fd(sock: socket.socket) -> Optional[int]:
+    fds = array.array("i")
+    message, ancdata, _, _ = sock.recvmsg(1, socket.CMSG_LEN(fds.itemsize))
+    if not message:
+        raise ConnectionResetError("File descriptor channel was closed")
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[: len(data) - (len(data) % fds.itemsize)])
+    return fds[0] if fds else None
+
+
+class ByteBuffer:
+    """
+    A growable byte buffer backed by a single bytearray. Length checks are O(1) and
+    consumed bytes at the front are skipped over by moving a start offset instead of
+    re-slicing. Memoryviews returned by view() are only valid until the next write.
+    """
+
+    __slots__ = ("_buffer", "_start", "_end")
+
+    def __init__(self, size: int = 0) -> None:
+        self._buffer = bytearray(size)
+        self._start = 0
+        self._end = 0
+
+    def write(self, new_bytes: Union[bytes, bytearray, memoryview]) -> None:
+        size = len(new_bytes)
+        if size:
+            self._ensure_free(size)
+            self._buffer[self._end : self._end + size] = new_bytes
+            self._end += size
+
+    def view(self, start: int = 0, end: int = None) -> memoryview:
+        stop = self._end if end is None else min(self._start + end, self._end)
+        return memoryview(self._buffer)[self._start + start : stop]
 
-    def write(self, new_bytes: bytes) -> None:
-        self._bytes_list.append(new_bytes)
+    def read(self) -> bytes:
+        return bytes(self.view())
 
-    def writelines(self, *bytes_list: Union[bytes, Iterable[bytes]]) -> None:
-        if len(bytes_list) == 1:
-            if isinstance(bytes_list[0], CollectionsInterable):
-                bytes_list = bytes_list[0]  # type: ignore
-        self._bytes_list.extend(bytes_list)  # type: ignore
+    def consume(self, size: int) -> None:
+        self._start = min(self._start + size, self._end)
+        if self._start == self._end:
+            self._start = self._end = 0
 
-    def read(self) -> bytes:
-        return b"".join(self._bytes_list)
+    def find(self, sub: bytes, start: int = 0) -> int:
+        index = self._buffer.find(sub, self._start + start, self._end)
+        return index if index == -1 else index - self._start
 
-    def readlines(self) -> List[bytes]:
-        return self._bytes_list
+    def startswith(self, prefix: bytes, start: int = 0) -> bool:
+        return self._buffer.startswith(prefix, self._start + start, self._end)
 
     def clear(self) -> None:
-        self._bytes_list = []
+        self._start = self._end = 0
+
+    def _ensure_free(self, size: int) -> None:
+        if len(self._buffer) - self._end >= size:
+            return
+        length = self._end - self._start
+        if len(self._buffer) - length >= size and self._start:
+            self._buffer[:length] = self._buffer[self._start : self._end]
+        else:
+            # a new bytearray rather than resizing in place so that any views still
+            # held on the old one don't make the resize fail
+            buffer = bytearray(max(length + size, len(self._buffer) * 2))
+            buffer[:length] = self._buffer[self._start : self._end]
+            self._buffer = buffer
+        self._start = 0
+        self._end = length
 
     def __contains__(self, item: bytes) -> bool:
-        return item in self.read()
+        return self.find(item) != -1
 
     def __len__(self) -> int:
-        return len(self.read())
+        return self._end - self._start
 
     def __bool__(self) -> bool:
-        return len(self) > 0
+        return self._end > self._start
+
+
+class BufferPool:
+    """
+    Preallocated bytearrays for sockets to recv_into so that every read doesn't
+    allocate a new RECV_BYTES sized bytes object. Buffers are checked out with
+    acquire() and handed back with release() once what was read into them has been
+    copied out, at most max_buffers are kept around for reuse.
+    """
+
+    __slots__ = ("buffer_size", "max_buffers", "_free")
+
+    def __init__(self, buffer_size: int, max_buffers: int = 64) -> None:
+        self.buffer_size = buffer_size
+        self.max_buffers = max_buffers
+        self._free: List[bytearray] = []
+
+    def acquire(self) -> bytearray:
+        if self._free:
+            return self._free.pop()
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer: bytearray) -> None:
+        if len(self._free) < self.max_buffers and len(buffer) == self.buffer_size:
+            self._free.append(buffer)
+
+
+async def sock_recv_into(
+    loop: asyncio.AbstractEventLoop,
+    sock: socket.socket,
+    pool: BufferPool,
+    sink: Callable[[memoryview], Any],
+) -> int:
+    """
+    Reads from the socket into a buffer from the pool and passes what was read to
+    sink, which has to copy anything it wants to keep since the buffer goes back to
+    the pool as soon as sink returns. Returns the number of bytes read. A buffer is
+    only checked out once the socket is readable, so idle connections don't hold
+    one while they wait.
+    """
+    want_write = False
+    while True:
+        if want_write:
+            await wait_writable(loop, sock)
+        # OpenSSL can have decrypted bytes buffered that the selector doesn't see
+        elif not (isinstance(sock, ssl.SSLSocket) and sock.pending()):
+            await wait_readable(loop, sock)
+        want_write = False
+        buffer = pool.acquire()
+        try:
+            size = sock.recv_into(buffer)
+            if size:
+                sink(memoryview(buffer)[:size])
+            return size
+        except (BlockingIOError, InterruptedError, ssl.SSLWantReadError):
+            pass
+        except ssl.SSLWantWriteError:
+            want_write = True
+        finally:
+            pool.release(buffer)
 
 
 class BytesReader:
@@ -144,10 +457,18 @@ else:
             self.startup_tasks = startup_tasks or []
             self.shutdown_tasks = shutdown_tasks or []
             self.request_message: Optional[Message] = None
+            self.request_body = b""
 
         async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
             self.request_message = await receive()
 
+            if scope["type"] == "http":
+                body = [self.request_message.get("body", b"")]
+                while self.request_message.get("more_body"):
+                    self.request_message = await receive()
+                    body.append(self.request_message.get("body", b""))
+                self.request_body = b"".join(body)
+
             if scope["type"] == "http":
                 await self.handle_http(scope, send)
             if scope["type"] == "lifespan":
@@ -184,10 +505,7 @@ else:
                         (to_bytes(name), to_bytes(value))
                     )
 
-            if self.request_message and "body" in self.request_message:
-                body = self.request_message["body"]
-            else:
-                body = b""
+            body = self.request_body
             if self.request_message and "headers" in self.request_message:
                 headers = scope["headers"]
             else:
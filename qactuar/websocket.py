@@ -1,9 +1,23 @@
 import struct
+import zlib
+from collections import deque
 from io import BytesIO
-from typing import List, Optional, Union
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
 
-from qactuar.exceptions import WebSocketError
+from qactuar.exceptions import MessageTooBig, WebSocketError
 from qactuar.header import Header
+from qactuar.util import ByteBuffer
+
+DEFLATE_PARAMS = {
+    "server_no_context_takeover",
+    "client_no_context_takeover",
+    "server_max_window_bits",
+    "client_max_window_bits",
+}
+DEFLATE_TAIL = b"\x00\x00\xff\xff"
+WINDOW_BITS = [str(bits) for bits in range(9, 16)]
+
+FrameBuffers = Tuple[bytes, memoryview]
 
 
 class Opcodes:
@@ -15,6 +29,183 @@ class Opcodes:
     PONG = 0x0A  # 1010
 
 
+def apply_mask(data: bytes, masking_key: bytes) -> bytes:
+    """
+    XORs data with the 4 byte masking key repeated over its length. Masking and
+    unmasking are the same operation. Both sides are turned into one big int so the
+    XOR runs in C over the whole payload instead of a byte at a time in Python.
+    """
+    length = len(data)
+    if not length:
+        return b""
+    key = (masking_key * (length // 4 + 1))[:length]
+    return (int.from_bytes(data, "big") ^ int.from_bytes(key, "big")).to_bytes(
+        length, "big"
+    )
+
+
+def pack_header(bits: int, length: int) -> bytes:
+    """
+    The header of a server frame, which is never masked.
+    """
+    if length < 126:
+        return struct.pack("!BB", bits, length)
+    if length < 2 ** 16:
+        return struct.pack("!BBH", bits, 126, length)
+    return struct.pack("!BBQ", bits, 127, length)  # mmm bbq
+
+
+def encode_frames(
+    message: bytes, opcode: int, rsv1: int = 0, fragment_size: int = 0
+) -> List[FrameBuffers]:
+    """
+    Frames a message as packed headers and views of the parts of the payload each
+    one carries, the payload itself is never copied. Text and binary messages are
+    split into fragment_size frames, control frames never are.
+    """
+    payload = memoryview(message)
+    size = len(payload)
+    if opcode < Opcodes.TERMINATE and fragment_size:
+        size = fragment_size
+    frames: List[FrameBuffers] = []
+    offset = 0
+    while True:
+        section = payload[offset : offset + size]
+        offset += len(section)
+        fin = 0b10000000 if offset >= len(payload) else 0
+        if frames:
+            # only the first frame of a message has the opcode and RSV1
+            header = pack_header(fin | Opcodes.CONTINUES, len(section))
+        else:
+            header = pack_header(fin | rsv1 | opcode, len(section))
+        frames.append((header, section))
+        if fin:
+            return frames
+
+
+def parse_extensions(value: str) -> List[Tuple[str, Dict[str, Optional[str]]]]:
+    """
+    Splits a Sec-WebSocket-Extensions header into (name, parameters) offers, in the
+    order the client prefers them. Parameters without a value map to None.
+    """
+    extensions = []
+    for extension in value.split(","):
+        name, *params = [part.strip() for part in extension.split(";")]
+        if not name:
+            continue
+        parameters: Dict[str, Optional[str]] = {}
+        for param in params:
+            key, _, param_value = param.partition("=")
+            parameters[key.strip().lower()] = param_value.strip().strip('"') or None
+        extensions.append((name.lower(), parameters))
+    return extensions
+
+
+class PerMessageDeflate:
+    """
+    The permessage-deflate extension from RFC 7692. Messages are compressed whole
+    with raw deflate, ending each one with a sync flush whose trailing empty block is
+    left off the wire. Unless one of the no_context_takeover parameters was agreed
+    the compressor and decompressor are kept for the whole connection, so repeated
+    JSON keys cost next to nothing after the first message.
+    """
+
+    def __init__(
+        self,
+        server_no_context_takeover: bool = False,
+        client_no_context_takeover: bool = False,
+        server_max_window_bits: int = 15,
+        client_max_window_bits: int = 15,
+        threshold: int = 0,
+        max_size: int = 0,
+    ) -> None:
+        self.server_no_context_takeover = server_no_context_takeover
+        self.client_no_context_takeover = client_no_context_takeover
+        self.server_max_window_bits = server_max_window_bits
+        self.client_max_window_bits = client_max_window_bits
+        self.threshold = threshold
+        self.max_size = max_size
+        self._compressor: Any = None
+        self._decompressor: Any = None
+
+    @classmethod
+    def negotiate(
+        cls,
+        offers: str,
+        window_bits: int = 15,
+        no_context_takeover: bool = False,
+        threshold: int = 0,
+        max_size: int = 0,
+    ) -> Optional["PerMessageDeflate"]:
+        """
+        Accepts the first permessage-deflate offer that can be met, None if there is
+        none. The server's own window is limited to window_bits and so is the
+        client's when the offer allows it.
+        """
+        for name, params in parse_extensions(offers):
+            if name != "permessage-deflate" or set(params) - DEFLATE_PARAMS:
+                continue
+            server_bits = params.get("server_max_window_bits")
+            if server_bits is not None and server_bits not in WINDOW_BITS:
+                # zlib can't compress with a window of 8 bits
+                continue
+            client_bits = params.get("client_max_window_bits", "15")
+            if client_bits is not None and client_bits not in WINDOW_BITS + ["8"]:
+                continue
+            return cls(
+                no_context_takeover or "server_no_context_takeover" in params,
+                "client_no_context_takeover" in params,
+                min(window_bits, int(server_bits or 15)),
+                # without the parameter the client can't be told to use less
+                min(window_bits, int(client_bits or 15))
+                if "client_max_window_bits" in params
+                else 15,
+                threshold,
+                max_size,
+            )
+        return None
+
+    @property
+    def response_header(self) -> str:
+        params = ["permessage-deflate"]
+        if self.server_no_context_takeover:
+            params.append("server_no_context_takeover")
+        if self.client_no_context_takeover:
+            params.append("client_no_context_takeover")
+        if self.server_max_window_bits < 15:
+            params.append(f"server_max_window_bits={self.server_max_window_bits}")
+        if self.client_max_window_bits < 15:
+            params.append(f"client_max_window_bits={self.client_max_window_bits}")
+        return "; ".join(params)
+
+    def compress(self, data: bytes) -> bytes:
+        if self._compressor is None or self.server_no_context_takeover:
+            self._compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION,
+                zlib.DEFLATED,
+                -self.server_max_window_bits,
+            )
+        data = self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+        return data[:-4] if data.endswith(DEFLATE_TAIL) else data
+
+    def decompress(self, data: bytes) -> bytes:
+        if self._decompressor is None or self.client_no_context_takeover:
+            # inflating with a bigger window than the client used is always fine
+            self._decompressor = zlib.decompressobj(
+                -max(self.client_max_window_bits, 9)
+            )
+        try:
+            data = self._decompressor.decompress(data + DEFLATE_TAIL, self.max_size)
+        except zlib.error as err:
+            raise WebSocketError(f"Message could not be decompressed: {err}")
+        if self._decompressor.unconsumed_tail:
+            # stopped at max_size with more still to come out
+            raise MessageTooBig(f"Message is bigger than {self.max_size} bytes")
+        return data
+
+
 class Frame:
     def __init__(self, data: bytes = None):
         self._data = data or b""
@@ -43,12 +234,7 @@ class Frame:
                 raise WebSocketError("Client messages must be masked")
             self.payload = self.data.read(self.payload_len)
             self.data.close()
-            self.payload = bytes(
-                [
-                    item ^ self.masking_key[index % 4]
-                    for index, item in enumerate(self.payload)
-                ]
-            )
+            self.payload = apply_mask(self.payload, self.masking_key)
 
     def get_payload_len(self, length: int) -> int:
         if length < 126:
@@ -74,11 +260,112 @@ class Frame:
     def is_pong(self) -> bool:
         return self.opcode == Opcodes.PONG
 
+    @property
+    def close_code(self) -> int:
+        if len(self.payload) >= 2:
+            return struct.unpack("!H", self.payload[:2])[0]
+        # the close frame had no status code
+        return 1005
+
+
+class FrameDecoder:
+    """
+    Incremental websocket frame decoder. Bytes are handed to feed() as they come off
+    the socket and every frame they complete is returned, anything after the last
+    complete frame is kept for the next call so frames that arrive together in one
+    read or split over several are never lost. Sizes are checked as soon as a frame
+    header arrives, so an oversized frame or message is refused before its payload
+    is buffered. A limit of 0 means no limit.
+    """
+
+    def __init__(self, max_frame_size: int = 0, max_message_size: int = 0) -> None:
+        self._buffer = ByteBuffer()
+        self._frame_size = 0
+        self._message_size = 0
+        # a data frame without fin was read and its continuations are due
+        self._fragmented = False
+        self.max_frame_size = max_frame_size
+        self.max_message_size = max_message_size
+        # RSV1 marks a compressed message once permessage-deflate is agreed
+        self.compression = False
+
+    def feed(self, data: Union[bytes, memoryview]) -> List[Frame]:
+        self._buffer.write(data)
+        frames: List[Frame] = []
+        while self._frame_size or self._parse_header():
+            if len(self._buffer) < self._frame_size:
+                break
+            frames.append(Frame(bytes(self._buffer.view(0, self._frame_size))))
+            self._buffer.consume(self._frame_size)
+            self._frame_size = 0
+        return frames
+
+    def _parse_header(self) -> bool:
+        available = len(self._buffer)
+        if available < 2:
+            return False
+        bits1, bits2 = self._buffer.view(0, 2)
+        if not bits2 & 0b10000000:
+            raise WebSocketError("Client messages must be masked")
+        payload_len = bits2 & 0b01111111
+        header_size = 6  # two bytes and the masking key
+        if payload_len == 126:
+            header_size += 2
+        elif payload_len == 127:
+            header_size += 8
+        if available < header_size:
+            return False
+        if payload_len == 126:
+            payload_len = struct.unpack("!H", self._buffer.view(2, 4))[0]
+        elif payload_len == 127:
+            payload_len = struct.unpack("!Q", self._buffer.view(2, 10))[0]
+        self._check_header(bits1, payload_len)
+        self._frame_size = header_size + payload_len
+        return True
+
+    def _check_header(self, bits: int, payload_len: int) -> None:
+        opcode = bits & 0b00001111
+        reserved = bits & 0b01110000
+        if reserved and (
+            reserved != 0b01000000
+            or not self.compression
+            or opcode == Opcodes.CONTINUES
+            or opcode >= Opcodes.TERMINATE
+        ):
+            raise WebSocketError("Reserved bits set that no extension uses")
+        if opcode >= Opcodes.TERMINATE:
+            if payload_len > 125 or not bits & 0b10000000:
+                raise WebSocketError("Control frames must be short and unfragmented")
+            return
+        if self.max_frame_size and payload_len > self.max_frame_size:
+            raise MessageTooBig(f"Frame of {payload_len} bytes is too big")
+        if opcode == Opcodes.CONTINUES:
+            if not self._fragmented:
+                raise WebSocketError("Continuation frame without a message to continue")
+        elif opcode not in (Opcodes.UTF8_TEXT, Opcodes.BINARY):
+            raise WebSocketError(f"Unknown opcode {opcode}")
+        elif self._fragmented:
+            raise WebSocketError("New message started before the last one finished")
+        else:
+            self._message_size = 0
+        self._fragmented = not bits & 0b10000000
+        self._message_size += payload_len
+        if self.max_message_size and self._message_size > self.max_message_size:
+            raise MessageTooBig(f"Message of {self._message_size} bytes is too big")
+
 
 class WebSocket:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        max_frame_size: int = 0,
+        max_message_size: int = 0,
+        fragment_size: int = 0,
+    ) -> None:
+        self.decoder = FrameDecoder(max_frame_size, max_message_size)
+        self.deflate: Optional[PerMessageDeflate] = None
+        self.fragment_size = fragment_size
+        self.pending_frames: Deque[Frame] = deque()
         self.read_frames: List[Frame] = []
-        self.write_frames: List[bytes] = []
         self.headers = Header()
         self.subprotocols: List[str] = []
         self.subprotocol = ""
@@ -119,19 +406,33 @@ class WebSocket:
         else:
             return False
 
+    def feed(self, data: Union[bytes, memoryview]) -> None:
+        self.pending_frames.extend(self.decoder.feed(data))
+
+    def next_frame(self) -> Optional[Frame]:
+        if self.pending_frames:
+            return self.pending_frames.popleft()
+        return None
+
     def add_read_frame(self, frame: Frame) -> None:
         self.read_frames.append(frame)
 
     def clear_frames(self) -> None:
         self.read_frames = []
-        self.write_frames = []
+
+    def use_deflate(self, deflate: PerMessageDeflate) -> None:
+        self.deflate = deflate
+        self.decoder.compression = True
 
     def read(self) -> Optional[Union[str, bytes]]:
+        if not self.is_text and not self.is_binary:
+            return None
+        payload = b"".join(frame.payload for frame in self.read_frames)
+        if self.read_frames[0].rsv1 and self.deflate:
+            payload = self.deflate.decompress(payload)
         if self.is_text:
-            return "".join(frame.payload.decode("utf-8") for frame in self.read_frames)
-        if self.is_binary:
-            return b"".join(frame.payload for frame in self.read_frames)
-        return None
+            return payload.decode("utf-8")
+        return payload
 
     #    1000
     #       1000 indicates a normal closure, meaning that the purpose for
@@ -150,6 +451,11 @@ class WebSocket:
     #       because it has received a type of data it cannot accept (e.g., an
     #       endpoint that understands only text data MAY send this if it
     #       receives a binary message).
+    #
+    #    1009
+    #       1009 indicates that an endpoint is terminating the connection
+    #       because it has received a message that is too big for it to
+    #       process.
 
     def write(
         self,
@@ -158,56 +464,29 @@ class WebSocket:
         ping: bool = False,
         pong: bool = False,
         close_status_code: int = 1000,
-    ) -> List[bytes]:
-        chunk_size = int((2 ** 32) / 8)
-        frames: List[bytes] = []
-        is_str = False
+    ) -> List[FrameBuffers]:
+        """
+        Returns the frames for a message, compressed if permessage-deflate was agreed
+        and the message is big enough to be worth it.
+        """
         if isinstance(message, str):
-            is_str = True
             message = message.encode("utf-8")
-        if not message and terminate:
-            message = str(close_status_code).encode("utf-8")
-
-        for section in [
-            message[i : i + chunk_size] for i in range(0, len(message), chunk_size)
-        ]:
-            section_len = len(section)
-            fin = section_len < chunk_size
-            with BytesIO() as frame:
-                bits = 0b00000000
-
-                if fin:
-                    bits |= 0b10000000
-                if terminate:
-                    bits |= 0b00001000
-                elif ping:
-                    bits |= 0b00001001
-                elif pong:
-                    bits |= 0b00001010
-                elif is_str and not frames:
-                    bits |= 0b00000001
-                elif not is_str and not frames:
-                    bits |= 0b00000010
-
-                if section_len < 126:
-                    frame.write(struct.pack("!BB", bits, section_len))
-                elif section_len < 2 ** 16:
-                    frame.write(struct.pack("!BBH", bits, 126, section_len))
-                else:
-                    frame.write(struct.pack("!BBQ", bits, 127, section_len))  # mmm bbq
-
-                frame.write(section)
-                frames.append(frame.getvalue())
-        self.write_frames = frames
-        return frames
-
-    def pop_write_frame(self, index: int = -1) -> Optional[bytes]:
-        if self.write_frames:
-            return self.write_frames.pop(index)
-        return None
-
-    @property
-    def response(self) -> Optional[bytes]:
-        if self.write_frames:
-            return b"".join(self.write_frames)
-        return None
+            opcode = Opcodes.UTF8_TEXT
+        else:
+            opcode = Opcodes.BINARY
+        if terminate:
+            opcode = Opcodes.TERMINATE
+            message = struct.pack("!H", close_status_code) + message
+        elif ping:
+            opcode = Opcodes.PING
+        elif pong:
+            opcode = Opcodes.PONG
+        rsv1 = 0
+        if (
+            self.deflate
+            and opcode < Opcodes.TERMINATE
+            and len(message) >= self.deflate.threshold
+        ):
+            message = self.deflate.compress(message)
+            rsv1 = 0b01000000
+        return encode_frames(message, opcode, rsv1, self.fragment_size)
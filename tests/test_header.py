@@ -0,0 +1,28 @@
+from qactuar.header import Header
+from qactuar.response import Response
+
+
+def test_lookups_ignore_case_of_stored_names():
+    header = Header([(b"Content-Type", b"text/plain"), (b"SET-COOKIE", b"a=1")])
+    assert "content-type" in header
+    assert b"Content-Type" in header
+    assert header["CONTENT-TYPE"] == "text/plain"
+    assert header.get_all("set-cookie") == ["a=1"]
+
+
+def test_repeated_headers_in_mixed_case():
+    header = Header([(b"Cookie", b"a=1"), (b"cookie", b"b=2")])
+    assert header["cookie"] == "a=1; b=2"
+    del header["COOKIE"]
+    assert len(header) == 0
+
+
+def test_has_token():
+    header = Header([(b"Connection", b"keep-alive, Upgrade")])
+    assert header.has_token("connection", "upgrade")
+    assert not header.has_token("connection", "close")
+
+
+def test_response_get_header():
+    response = Response(headers=[(b"Content-Length", b"5")])
+    assert response.get_header(b"content-length") == b"5"
@@ -0,0 +1,113 @@
+import pytest
+
+from qactuar.exceptions import HTTPError
+from qactuar.parser import RequestParser
+
+
+def head(*headers: bytes) -> bytes:
+    return b"POST / HTTP/1.1\r\nHost: a\r\n" + b"".join(h + b"\r\n" for h in headers)
+
+
+def parse(data: bytes) -> RequestParser:
+    parser = RequestParser()
+    parser.feed(data)
+    return parser
+
+
+@pytest.mark.parametrize(
+    "value", [b"-5", b"+5", b"1_0", b"0x5", b"5 5", b"", b"\xd9\xa5"]
+)
+def test_invalid_content_length(value):
+    with pytest.raises(HTTPError):
+        parse(head(b"Content-Length: " + value) + b"\r\n" + b"5\r\n\r\nGET / HTTP/1.1")
+
+
+def test_negative_content_length_does_not_rewind():
+    with pytest.raises(HTTPError):
+        parse(head(b"Content-Length: -5") + b"\r\n")
+
+
+def test_conflicting_content_lengths():
+    with pytest.raises(HTTPError):
+        parse(head(b"Content-Length: 5", b"Content-Length: 6") + b"\r\nhello!")
+    with pytest.raises(HTTPError):
+        parse(head(b"Content-Length: 5, 6") + b"\r\nhello!")
+
+
+def test_repeated_content_length():
+    parser = parse(head(b"Content-Length: 5", b"Content-Length: 5") + b"\r\nhello")
+    assert parser.complete
+    assert parser.take_body() == b"hello"
+    parser = parse(head(b"Content-Length: 5, 5") + b"\r\nhello")
+    assert parser.take_body() == b"hello"
+
+
+def test_content_length_body():
+    parser = parse(head(b"Content-Length: 5") + b"\r\nhel")
+    assert parser.headers_complete
+    assert not parser.complete
+    parser.feed(b"lo")
+    assert parser.complete
+    assert parser.take_body() == b"hello"
+
+
+@pytest.mark.parametrize("size", [b"-5", b"+5", b" 5", b"0x5", b"5_0", b"", b"g"])
+def test_invalid_chunk_size(size):
+    with pytest.raises(HTTPError):
+        parse(head(b"Transfer-Encoding: chunked") + b"\r\n" + size + b"\r\nhello\r\n")
+
+
+def test_chunked_body():
+    parser = parse(
+        head(b"Transfer-Encoding: chunked")
+        + b"\r\n5;name=value\r\nhello\r\nA \r\n0123456789\r\n0\r\nTrailer: x\r\n\r\n"
+    )
+    assert parser.complete
+    assert parser.take_body() == b"hello0123456789"
+
+
+def test_pipelined_requests():
+    parser = parse(
+        head(b"Content-Length: 2")
+        + b"\r\nhiGET /next HTTP/1.1\r\nHost: a\r\n\r\nGET /last HTTP/1.1\r\n"
+    )
+    assert parser.complete
+    assert parser.take_body() == b"hi"
+    parser.reset()
+    parser.feed(b"")
+    assert parser.complete
+    assert parser.request.path == "/next"
+    parser.reset()
+    parser.feed(b"")
+    assert not parser.headers_complete
+    parser.feed(b"Host: a\r\n\r\n")
+    assert parser.complete
+    assert parser.request.path == "/last"
+    assert not parser.has_buffered_data
+
+
+def test_leftover_bytes():
+    parser = parse(
+        b"GET / HTTP/1.1\r\nHost: a\r\nUpgrade: websocket\r\n\r\n\x81\x85abcd"
+    )
+    assert parser.complete
+    assert parser.take_buffered() == b"\x81\x85abcd"
+    assert not parser.has_buffered_data
+
+
+def test_head_too_big():
+    with pytest.raises(HTTPError) as err:
+        parse(head(b"X-Big: " + b"x" * 70000) + b"\r\n")
+    assert err.value.args[0] == 431
+    parser = RequestParser()
+    parser.feed(head(b"X-Big: " + b"x" * 60000))
+    with pytest.raises(HTTPError):
+        parser.feed(b"X-Big: " + b"x" * 10000 + b"\r\n")
+
+
+def test_chunk_line_too_big():
+    chunked = head(b"Transfer-Encoding: chunked") + b"\r\n"
+    with pytest.raises(HTTPError):
+        parse(chunked + b"5;" + b"x" * 5000 + b"\r\nhello\r\n0\r\n\r\n")
+    with pytest.raises(HTTPError):
+        parse(chunked + b"0\r\nTrailer: " + b"x" * 70000 + b"\r\n\r\n")
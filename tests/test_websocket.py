@@ -0,0 +1,105 @@
+import os
+import struct
+
+import pytest
+
+from qactuar.exceptions import MessageTooBig, WebSocketError
+from qactuar.websocket import FrameDecoder, Opcodes, apply_mask
+
+
+def frame(opcode: int, payload: bytes = b"", fin: bool = True) -> bytes:
+    key = os.urandom(4)
+    bits1 = (0b10000000 if fin else 0) | opcode
+    length = len(payload)
+    if length < 126:
+        head = struct.pack("!BB", bits1, 0b10000000 | length)
+    elif length < 65536:
+        head = struct.pack("!BBH", bits1, 0b10000000 | 126, length)
+    else:
+        head = struct.pack("!BBQ", bits1, 0b10000000 | 127, length)
+    return head + key + apply_mask(payload, key)
+
+
+def test_frames_split_and_joined():
+    decoder = FrameDecoder()
+    data = frame(Opcodes.UTF8_TEXT, b"hello") + frame(Opcodes.BINARY, b"x" * 300)
+    frames = decoder.feed(data[:3]) + decoder.feed(data[3:10]) + decoder.feed(data[10:])
+    assert [(f.opcode, f.payload) for f in frames] == [
+        (Opcodes.UTF8_TEXT, b"hello"),
+        (Opcodes.BINARY, b"x" * 300),
+    ]
+
+
+def test_fragmented_message():
+    decoder = FrameDecoder(max_message_size=10)
+    frames = decoder.feed(
+        frame(Opcodes.UTF8_TEXT, b"hel", fin=False)
+        + frame(Opcodes.PING, b"p")
+        + frame(Opcodes.CONTINUES, b"lo", fin=False)
+        + frame(Opcodes.CONTINUES, b"!")
+        + frame(Opcodes.BINARY, b"0123456789")
+    )
+    assert [f.opcode for f in frames] == [
+        Opcodes.UTF8_TEXT,
+        Opcodes.PING,
+        Opcodes.CONTINUES,
+        Opcodes.CONTINUES,
+        Opcodes.BINARY,
+    ]
+
+
+def test_new_message_during_fragmented_message():
+    decoder = FrameDecoder(max_message_size=1000)
+    decoder.feed(frame(Opcodes.UTF8_TEXT, b"x" * 500, fin=False))
+    with pytest.raises(WebSocketError):
+        decoder.feed(frame(Opcodes.UTF8_TEXT, b"x" * 500, fin=False))
+
+
+def test_continuation_without_message():
+    decoder = FrameDecoder()
+    with pytest.raises(WebSocketError):
+        decoder.feed(frame(Opcodes.CONTINUES, b"x"))
+    decoder = FrameDecoder()
+    decoder.feed(frame(Opcodes.BINARY, b"x"))
+    with pytest.raises(WebSocketError):
+        decoder.feed(frame(Opcodes.CONTINUES, b"x"))
+
+
+def test_unknown_opcode():
+    with pytest.raises(WebSocketError):
+        FrameDecoder().feed(frame(3, b"x"))
+
+
+def test_message_size_counts_every_fragment():
+    decoder = FrameDecoder(max_message_size=1000)
+    decoder.feed(frame(Opcodes.BINARY, b"x" * 500, fin=False))
+    with pytest.raises(MessageTooBig):
+        decoder.feed(frame(Opcodes.CONTINUES, b"x" * 501))
+
+
+def test_frame_too_big_before_payload_arrives():
+    decoder = FrameDecoder(max_frame_size=100)
+    with pytest.raises(MessageTooBig):
+        decoder.feed(frame(Opcodes.BINARY, b"x" * 101)[:8])
+
+
+def test_control_frames():
+    with pytest.raises(WebSocketError):
+        FrameDecoder().feed(frame(Opcodes.PING, b"x" * 126))
+    with pytest.raises(WebSocketError):
+        FrameDecoder().feed(frame(Opcodes.PING, b"x", fin=False))
+
+
+def test_unmasked_frame():
+    with pytest.raises(WebSocketError):
+        FrameDecoder().feed(b"\x81\x05")
+
+
+def test_reserved_bits():
+    data = bytearray(frame(Opcodes.UTF8_TEXT, b"x"))
+    data[0] |= 0b01000000
+    with pytest.raises(WebSocketError):
+        FrameDecoder().feed(bytes(data))
+    decoder = FrameDecoder()
+    decoder.compression = True
+    assert decoder.feed(bytes(data))[0].rsv1